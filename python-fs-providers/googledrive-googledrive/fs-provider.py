@@ -1,21 +1,13 @@
 from dataiku.fsprovider import FSProvider
 
 import os
-import shutil
 import re
 import logging
 
-from googleapiclient.errors import HttpError
-
 from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
 from dss_constants import DSSConstants
 from dku_googledrive.session import GoogleDriveSession
 
-try:
-    from BytesIO import BytesIO  # for Python 2
-except ImportError:
-    from io import BytesIO  # for Python 3
-
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
                     format='googledrive plugin %(levelname)s - %(message)s')
@@ -64,9 +56,22 @@ class GoogleDriveFSProvider(FSProvider):
 
     def close(self):
         """
-        Perform any necessary cleanup
+        Perform any necessary cleanup. Waits for the background uploads, raising if one of them failed
         """
         logger.info('closing googledrive session')
+        self.session.close()
+
+    def flush_pending_uploads(self, full_path):
+        # Files still uploading in the background must be on Google Drive before anything looks at their path
+        if self.session.write_behind is not None:
+            self.session.write_behind.flush(full_path)
+
+    def get_metrics(self):
+        """
+        Return the Google Drive API usage of this provider: calls by method with latency histograms,
+        pages listed, retries, waits and bytes transferred
+        """
+        return self.session.metrics.get_summary()
 
     def stat(self, path):
         """
@@ -75,6 +80,7 @@ class GoogleDriveFSProvider(FSProvider):
         """
         full_path = self.get_full_path(path)
         logger.info('stat:path="{}", full_path="{}"'.format(path, full_path))
+        self.flush_pending_uploads(full_path)
 
         item = self.session.get_item_from_path(full_path)
 
@@ -100,6 +106,7 @@ class GoogleDriveFSProvider(FSProvider):
         """
         full_path = self.get_full_path(self.get_rel_path(path))
         logger.info('browse:path="{}", full_path="{}"'.format(path, full_path))
+        self.flush_pending_uploads(full_path)
 
         item = self.session.get_item_from_path(full_path)
 
@@ -144,10 +151,13 @@ class GoogleDriveFSProvider(FSProvider):
         """
         full_path = self.get_full_path(path)
         logger.info('enumerate:path="{}", full_path="{}"'.format(path, full_path))
+        self.flush_pending_uploads(full_path)
 
         item = self.session.get_item_from_path(full_path)
 
         if item is None:
+            # Matches files by name prefix anywhere in the root
+            self.flush_pending_uploads(self.get_root_path())
             no_directory_item = self.session.get_item_from_path(self.get_root_path())
             if not no_directory_item:
                 return None
@@ -188,22 +198,33 @@ class GoogleDriveFSProvider(FSProvider):
 
     def list_recursive(self, path, folder, first_non_empty):
         paths = []
+        files = []
         if path == "/":
             path = ""
-        children = self.session.directory(folder, root_path=self.get_rel_path(path))
-        for child in children:
+        if first_non_empty:
+            # Only tells DSS whether there is data, which a few single item queries can answer
+            first_file = self.session.find_first_file(folder)
+            if first_file is None:
+                return paths
+            child_path, child = first_file
+            return [self.get_enumerate_entry(path + child_path, child)]
+        for child_path, child in self.session.list_tree(folder):
             if gdu.is_directory(child):
-                paths.extend(self.list_recursive(path + '/' + gdu.get_name(child), child, first_non_empty))
-            else:
-                paths.append({
-                    DSSConstants.PATH: path + '/' + gdu.get_name(child),
-                    DSSConstants.SIZE: gdu.file_size(child),
-                    DSSConstants.LAST_MODIFIED: gdu.get_last_modified(child)
-                })
-                if first_non_empty:
-                    return paths
+                continue
+            paths.append(self.get_enumerate_entry(path + child_path, child))
+            files.append((self.get_full_path(path + child_path), child))
+        if self.session.read_ahead is not None:
+            # DSS usually reads the files it just enumerated, in this order
+            self.session.read_ahead.set_listing(files)
         return paths
 
+    def get_enumerate_entry(self, path, item):
+        return {
+            DSSConstants.PATH: path,
+            DSSConstants.SIZE: gdu.file_size(item),
+            DSSConstants.LAST_MODIFIED: gdu.get_last_modified(item)
+        }
+
     def delete_recursive(self, path):
         """
         Delete recursively from path. Return the number of deleted files (optional)
@@ -211,8 +232,10 @@ class GoogleDriveFSProvider(FSProvider):
         full_path = self.get_full_path(path)
         logger.info('delete_recursive:path="{}", full_path="{}"'.format(path, full_path))
         self.assert_path_is_not_root(full_path)
-        item = self.session.get_item_from_path(full_path)
-        deleted_item_count = self.session.googledrive_delete(item)
+        self.flush_pending_uploads(full_path)
+        items = self.session.get_items_from_path(full_path)
+        deleted_item_count = self.session.googledrive_trash(items)
+        self.session.invalidate_path(full_path)
         return deleted_item_count
 
     def move(self, from_path, to_path):
@@ -221,36 +244,31 @@ class GoogleDriveFSProvider(FSProvider):
         """
         full_from_path = self.get_full_path(from_path)
         full_to_path = self.get_full_path(to_path)
-        from_name = os.path.basename(from_path)
-        to_name = os.path.basename(to_path)
+        from_parent_path, from_name = os.path.split(self.get_normalized_path(full_from_path))
+        to_parent_path, to_name = os.path.split(self.get_normalized_path(full_to_path))
         logger.info('move:from "{}" to "{}"'.format(full_from_path, full_to_path))
+        self.flush_pending_uploads(full_from_path)
+        self.flush_pending_uploads(full_to_path)
 
         try:
-            from_item = self.session.get_item_from_path(full_from_path)
+            from_item = None
+            if from_parent_path == to_parent_path:
+                # A file we just wrote is renamed from the folder index, without resolving its path
+                from_item = self.session.get_indexed_item(full_from_path)
+            if from_item is None:
+                from_item = self.session.get_item_from_path(full_from_path)
             if from_item is None:
                 return False
 
-            if from_name == to_name:
-                to_item = self.session.get_item_from_path(os.path.split(full_to_path)[0])
-
-                prev_parents = ','.join(p for p in from_item.get(gdu.PARENTS))
-                self.session.drive.files().update(
-                    fileId=gdu.get_id(from_item),
-                    addParents=gdu.get_id(to_item),
-                    removeParents=prev_parents,
-                    fields=gdu.ID_PARENTS_FIELDS,
-                ).execute()
-            else:
-                file = self.session.drive.files().get(fileId=gdu.get_id(from_item)).execute()
-                del file[gdu.ID]
-                file[gdu.NAME] = to_name
-                self.session.drive.files().update(
-                    fileId=gdu.get_id(from_item),
-                    body=file,
-                    fields=gdu.ID_PARENTS_FIELDS,
-                ).execute()
-        except HttpError as err:
-            raise Exception('Error from Google Drive while moving files: ' + err)
+            new_parent_id = None
+            if from_parent_path != to_parent_path:
+                # Known folders are cached, so moving many files to the same folder looks it up once
+                new_parent_id = self.session.create_directory_from_path(to_parent_path)
+            new_name = to_name if to_name != from_name else None
+            self.session.googledrive_move(from_item, new_name=new_name, new_parent_id=new_parent_id)
+        finally:
+            self.session.invalidate_path(full_from_path, membership_changed=False)
+            self.session.invalidate_path(full_to_path, membership_changed=False)
 
         return True
 
@@ -260,12 +278,15 @@ class GoogleDriveFSProvider(FSProvider):
         """
         full_path = self.get_full_path(path)
         logger.info('read:path="{}", full_path="{}"'.format(path, full_path))
+        self.flush_pending_uploads(full_path)
+        if self.session.read_ahead is not None and self.session.read_ahead.read(full_path, stream, limit=limit):
+            return
         item = self.session.get_item_from_path(full_path)
 
         if item is None:
             raise ValueError('Path doesn t exist')
 
-        self.session.googledrive_download(item, stream)
+        self.session.googledrive_download(item, stream, limit=limit)
 
     def write(self, path, stream):
         """
@@ -274,12 +295,11 @@ class GoogleDriveFSProvider(FSProvider):
         full_path = self.get_full_path(path)
         logger.info('write:path="{}", full_path="{}"'.format(path, full_path))
 
-        bio = BytesIO()
-        shutil.copyfileobj(stream, bio)
-        bio.seek(0)
-        base_path, file_name = os.path.split(full_path)
-        directory_id = self.session.create_directory_from_path(base_path)
-        self.session.googledrive_upload(file_name, bio, parent_id=directory_id)
+        if self.session.write_behind is not None:
+            # Returns once the stream is spooled, close() waiting for the upload
+            self.session.write_behind.write(full_path, stream)
+            return
+        self.session.upload_to_path(full_path, stream)
 
     def assert_path_is_not_root(self, path):
         black_list = [None, "", "root"]
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from googleapiclient.discovery import build_from_document
+
+DISCOVERY_DOCUMENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "drive.v3.json")
+
+_discovery_document = None
+_discovery_document_lock = threading.Lock()
+
+
+def load_discovery_document():
+    """
+    Return the Drive v3 discovery document shipped with the plugin, parsed once per process
+    """
+    global _discovery_document
+    with _discovery_document_lock:
+        if _discovery_document is None:
+            with open(DISCOVERY_DOCUMENT_PATH) as discovery_file:
+                _discovery_document = json.load(discovery_file)
+        return _discovery_document
+
+
+def build_drive(http):
+    # Built from the bundled document, so that no discovery request is made
+    return build_from_document(load_discovery_document(), http=http)
+
+
+class AuthorizedClients():
+    """
+    Credentials and the Drive API client authorized with them
+
+    :param credentials: the oauth2client credentials
+    :param create_http: function returning a new unauthorized, thread-safe transport
+    """
+    def __init__(self, credentials, create_http):
+        self.credentials = credentials
+        self.create_http = create_http
+        self.drive = None
+        self.http = None
+        self.lock = threading.Lock()
+
+    def get_drive(self):
+        with self.lock:
+            if self.drive is None:
+                self.http = self.create_http()
+                self.drive = build_drive(self.credentials.authorize(self.http))
+            return self.drive
+
+    def get_http(self):
+        """
+        Return the transport of the Drive client, for the requests made without it. They are not authorized by it
+        """
+        self.get_drive()
+        return self.http
+
+
+class ClientPool():
+    """
+    Authorized clients shared by the sessions of the process using the same credentials, so that a new session
+    neither parses the credentials, fetches an access token nor opens connections again
+
+    :param max_size: maximum number of credentials kept, the least recently used ones being dropped
+    """
+    DEFAULT_MAX_SIZE = 32
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(settings):
+        # Secrets are not kept in clear as keys
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, settings, create_credentials, create_http):
+        """
+        Return the AuthorizedClients of settings, made of the secret and of the transport settings,
+        calling create_credentials() if they are not pooled yet
+        """
+        key = self.get_key(settings)
+        with self.lock:
+            clients = self.entries.get(key)
+            if clients is not None:
+                self.entries.move_to_end(key)
+                return clients
+        clients = AuthorizedClients(create_credentials(), create_http)
+        with self.lock:
+            # Another thread may have created them meanwhile, the first ones are kept
+            clients = self.entries.setdefault(key, clients)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return clients
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+
+
+client_pool = ClientPool()
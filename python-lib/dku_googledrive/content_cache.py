@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+
+logger = logging.getLogger(__name__)
+
+
+class ContentCache():
+    """
+    Local copy of downloaded files, evicting the least recently used ones above a size cap.
+    A file is keyed by its ID and version, so a modified file is downloaded again.
+    Entries are only found from items the caller listed with its own credentials
+
+    :param directory: where the cached files are stored, shared by all the processes of the node
+    :param max_size: size in bytes above which the least recently used files are evicted
+    """
+    TEMPORARY_PREFIX = ".tmp-"
+    TEMPORARY_FILES_TTL = 3600
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.total_size = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(item, export_mime_type=None):
+        """
+        Return the cache key of the content of item, or None if its version is unknown
+        """
+        modified_time = item.get(gdu.MODIFIED_TIME)
+        if modified_time is None:
+            return None
+        version = "{}/{}/{}/{}".format(gdu.get_id(item), modified_time, item.get(gdu.MD5_CHECKSUM, ""), export_mime_type or "")
+        return hashlib.sha256(version.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """
+        Return the cached content of key as a file opened for reading, or None
+        """
+        path = self.get_path(key)
+        try:
+            cached_file = open(path, "rb")
+        except (IOError, OSError):
+            return None
+        try:
+            # The modification time orders the entries for eviction
+            os.utime(path, None)
+        except (IOError, OSError):
+            pass
+        return cached_file
+
+    def create_writer(self, key):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        return ContentCacheWriter(self, key)
+
+    def add(self, key, temporary_path):
+        size = os.path.getsize(temporary_path)
+        if size > self.max_size:
+            os.remove(temporary_path)
+            return
+        # Atomic, so that other processes never see a partial file
+        os.replace(temporary_path, self.get_path(key))
+        with self.lock:
+            if self.total_size is None:
+                self.total_size = self.get_directory_size()
+            else:
+                self.total_size = self.total_size + size
+            if self.total_size > self.max_size:
+                self.evict()
+
+    def get_entries(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(self.TEMPORARY_PREFIX):
+                # Left by a process that stopped while downloading
+                if now - stat.st_mtime > self.TEMPORARY_FILES_TTL:
+                    remove_file(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get_directory_size(self):
+        return sum(size for modified_time, size, path in self.get_entries())
+
+    def evict(self):
+        # Other processes add files too, so the directory is scanned again rather than trusting our own count
+        entries = sorted(self.get_entries())
+        total_size = sum(size for modified_time, size, path in entries)
+        for modified_time, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            if remove_file(path):
+                logger.info("Evicted {} from the content cache".format(path))
+            total_size = total_size - size
+        self.total_size = total_size
+
+
+class ContentCacheWriter():
+    """
+    Temporary file in the cache directory, added to the cache once complete.
+    Failing to write it, for instance on a full disk, only leaves the content out of the cache
+
+    :param cache: the ContentCache to add the file to
+    :param key: the key of the content being written
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.file = tempfile.NamedTemporaryFile(dir=cache.directory, prefix=ContentCache.TEMPORARY_PREFIX, delete=False)
+        self.is_discarded = False
+
+    def write(self, data):
+        if self.is_discarded:
+            return
+        try:
+            self.file.write(data)
+        except (IOError, OSError) as err:
+            # The download goes on, the DSS stream being written apart from the cache
+            logger.warning("Could not write {} to the content cache ({}), downloading without caching".format(self.key, err))
+            self.discard()
+
+    def commit(self):
+        if self.is_discarded:
+            return
+        try:
+            self.file.close()
+            self.cache.add(self.key, self.file.name)
+        except (IOError, OSError) as err:
+            logger.warning("Could not add {} to the content cache ({})".format(self.key, err))
+            remove_file(self.file.name)
+
+    def discard(self):
+        if self.is_discarded:
+            return
+        self.is_discarded = True
+        try:
+            self.file.close()
+        except (IOError, OSError):
+            pass
+        remove_file(self.file.name)
+
+
+class TeeStreamWriter():
+    """
+    Write to several streams at once
+
+    :param streams: the streams to write to
+    """
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, data):
+        for stream in self.streams:
+            stream.write(data)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+
+logger = logging.getLogger(__name__)
+
+
+class DriveSnapshot():
+    """
+    In-memory folder tree of a whole shared drive, rebuilt from one flat, paginated files.list sweep
+
+    :param session: the GoogleDriveSession used to reach Google Drive
+    :param drive_id: ID of the shared drive
+    :param ttl: number of seconds the snapshot is reused before sweeping the drive again
+    """
+    DEFAULT_TTL = 60
+
+    def __init__(self, session, drive_id, ttl=DEFAULT_TTL):
+        self.session = session
+        self.drive_id = drive_id
+        self.ttl = ttl
+        self.children = None
+        self.timestamp = None
+        self.shared_drive = None
+        self.lock = threading.Lock()
+
+    def is_shared_drive(self):
+        """
+        Whether drive_id really is a shared drive, checked once. A folder ID cannot be swept with corpora=drive
+        """
+        with self.lock:
+            if self.shared_drive is None:
+                self.shared_drive = self.session.googledrive_is_shared_drive(self.drive_id)
+                if not self.shared_drive:
+                    logger.info("{} is not a shared drive, it will be listed folder by folder".format(self.drive_id))
+            return self.shared_drive
+
+    def mark_stale(self):
+        self.children = None
+
+    def get_children(self):
+        """
+        Return the snapshot as a dict of children lists by parent ID, sweeping the drive if it is missing or too old
+        """
+        with self.lock:
+            if self.children is None or time.time() - self.timestamp > self.ttl:
+                items = self.session.googledrive_list("trashed=false", drive_id=self.drive_id)
+                logger.info("Swept {} items from shared drive {}".format(len(items), self.drive_id))
+                children = {}
+                for item in items:
+                    for parent_id in item.get(gdu.PARENTS, []):
+                        children.setdefault(parent_id, []).append(item)
+                self.children = children
+                self.timestamp = time.time()
+            return self.children
+
+    def list_tree(self, folder_id):
+        children = self.get_children()
+        return gdu.walk_tree(
+            [folder_id],
+            lambda folder_ids: [(parent_id, child) for parent_id in folder_ids for child in children.get(parent_id, [])]
+        )
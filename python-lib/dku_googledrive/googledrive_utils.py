@@ -1,5 +1,6 @@
 import os
 import string
+import tempfile
 from datetime import datetime
 
 
@@ -17,7 +18,9 @@ class GoogleDriveUtils(object):
     MIME_TYPE = "mimeType"
     PARENTS = "parents"
     SIZE = "size"
+    MD5_CHECKSUM = "md5Checksum"
     ID_PARENTS_FIELDS = "id, parents"
+    ITEM_FIELDS = "id, name, size, parents, mimeType, createdTime, modifiedTime, md5Checksum"
     ID = "id"
     TRUE = "true"
     FALSE = "false"
@@ -28,7 +31,12 @@ class GoogleDriveUtils(object):
     XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     GOOGLE_APPS = "google-apps"
     BINARY_STREAM = "binary/octet-stream"
-    LIST_FIELDS = "nextPageToken, files(id, name, size, parents, mimeType, createdTime, modifiedTime)"
+    LIST_FIELDS = "nextPageToken, files(id, name, size, parents, mimeType, createdTime, modifiedTime, md5Checksum)"
+    PATH_LIST_FIELDS = "nextPageToken, files(id, name, parents, mimeType)"
+    NAME_LIST_FIELDS = "nextPageToken, files(id, name)"
+    FOLDER_LIST_FIELDS = "nextPageToken, files(id, mimeType)"
+    PATH_RESOLUTION_FIELDS = "nextPageToken, incompleteSearch, files(id, name, parents, mimeType)"
+    MAX_PATH_RESOLUTION_PAGES = 2
     GOOGLE_DOC_MIME_EQUIVALENCE = {
         SPREADSHEET: CSV,
         GOOGLE_DOCUMENT: "text/plain",
@@ -42,6 +50,29 @@ class GoogleDriveUtils(object):
         "application/vnd.google-apps.presentation": "application/vnd.openxmlformats-officedocument.presentationml.presentation"
     }
     DEFAULT_MIME_TYPE = CSV
+    MAX_QUERY_LENGTH = 2000
+    QUERY_EXTRA_CLAUSES_LENGTH = 100
+    DEFAULT_MAX_PARALLEL_REQUESTS = 4
+    DEFAULT_UPLOAD_CHUNK_SIZE = 16
+    DEFAULT_MULTIPART_UPLOAD_THRESHOLD = 5
+    MEGABYTE = 1024 * 1024
+    DOWNLOAD_CHUNK_SIZE = MEGABYTE
+    MAX_BATCH_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    KNOWN_DIRECTORIES_TTL = 3600
+    FOLDER_INDEX_TTL = 60
+    DEFAULT_QUERIES_PER_100_SECONDS = 20000
+    DEFAULT_READ_AHEAD_BUFFER_SIZE = 256
+    DEFAULT_WRITE_BEHIND_BUFFER_SIZE = 256
+    READ_AHEAD_MAX_MEMORY_PER_FILE = 8 * MEGABYTE
+    WRITE_BEHIND_MAX_MEMORY_PER_FILE = 8 * MEGABYTE
+    DEFAULT_CONTENT_CACHE_SIZE = 1024
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_READ_TIMEOUT = 60
+    MAX_IDLE_HTTP_CLIENTS = 16
+    TOKEN_INFO_URL = "https://oauth2.googleapis.com/tokeninfo"
+    USER_AGENT = "dss-googledrive-plugin/2.0"
+    LOCAL_DIRECTORY_NAME = "googledrive-plugin"
 
     @staticmethod
     def split_path(path_and_file):
@@ -155,7 +186,7 @@ class GoogleDriveUtils(object):
                 raise GoogleDriveUtilsError('An element of the path starts with ".well-known/acme-challenge"')
 
     @staticmethod
-    def query_parents_in(parent_ids, name=None, name_contains=None, trashed=None):
+    def query_parents_in(parent_ids, name=None, name_contains=None, trashed=None, is_folder=None):
         query = "("
         is_first = True
         for parent_id in parent_ids:
@@ -163,16 +194,106 @@ class GoogleDriveUtils(object):
                 is_first = False
             else:
                 query = query + " or "
-            query = query + "'{}' in parents".format(parent_id)
+            query = query + "'{}' in parents".format(GoogleDriveUtils.escape_query_value(parent_id))
         query = query + ")"
         if trashed is not None:
             query = query + ' and trashed=' + (GoogleDriveUtils.TRUE if trashed else GoogleDriveUtils.FALSE)
         if name is not None:
-            query = query + " and name='" + name + "'"
+            query = query + " and name='" + GoogleDriveUtils.escape_query_value(name) + "'"
         if name_contains is not None:
-            query = query + " and name contains '" + name_contains + "'"
+            query = query + " and name contains '" + GoogleDriveUtils.escape_query_value(name_contains) + "'"
+        if is_folder is not None:
+            query = query + " and mimeType" + ("=" if is_folder else "!=") + "'" + GoogleDriveUtils.FOLDER + "'"
         return query
 
+    @staticmethod
+    def query_names_in(names, trashed=None, is_folder=None):
+        query = "(" + " or ".join("name='{}'".format(GoogleDriveUtils.escape_query_value(name)) for name in names) + ")"
+        if trashed is not None:
+            query = query + ' and trashed=' + (GoogleDriveUtils.TRUE if trashed else GoogleDriveUtils.FALSE)
+        if is_folder is not None:
+            query = query + " and mimeType" + ("=" if is_folder else "!=") + "'" + GoogleDriveUtils.FOLDER + "'"
+        return query
+
+    @staticmethod
+    def escape_query_value(value):
+        """
+        Escape value to be used between single quotes in a Google Drive query
+        """
+        return value.replace("\\", "\\\\").replace("'", "\\'")
+
+    @staticmethod
+    def split_names_for_query(names, max_query_length=MAX_QUERY_LENGTH):
+        """
+        Split names in batches small enough for query_names_in to stay under max_query_length
+        """
+        batches = []
+        batch = []
+        query_length = GoogleDriveUtils.QUERY_EXTRA_CLAUSES_LENGTH
+        for name in names:
+            name_length = len("name='{}' or ".format(GoogleDriveUtils.escape_query_value(name)))
+            if batch and query_length + name_length > max_query_length:
+                batches.append(batch)
+                batch = []
+                query_length = GoogleDriveUtils.QUERY_EXTRA_CLAUSES_LENGTH
+            batch.append(name)
+            query_length = query_length + name_length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def split_ids_for_query(ids, max_query_length=MAX_QUERY_LENGTH):
+        """
+        Split ids in batches small enough for query_parents_in to stay under max_query_length
+        """
+        batches = []
+        batch = []
+        query_length = GoogleDriveUtils.QUERY_EXTRA_CLAUSES_LENGTH
+        for id in ids:
+            id_length = len("'{}' in parents or ".format(id))
+            if batch and query_length + id_length > max_query_length:
+                batches.append(batch)
+                batch = []
+                query_length = GoogleDriveUtils.QUERY_EXTRA_CLAUSES_LENGTH
+            batch.append(id)
+            query_length = query_length + id_length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def walk_tree(folder_ids, get_children_of):
+        """
+        Walk breadth-first below folder_ids. get_children_of(folder_ids) returns (parent_id, child) pairs for a whole level.
+        Generates (relative_path, child) tuples, folders included, paths being relative to the folder they are in
+        """
+        folder_paths = dict((folder_id, "") for folder_id in folder_ids)
+        level = list(folder_paths)
+        while level:
+            next_level = []
+            for parent_id, child in get_children_of(level):
+                child_path = folder_paths[parent_id] + '/' + GoogleDriveUtils.get_name(child)
+                yield child_path, child
+                child_id = GoogleDriveUtils.get_id(child)
+                if GoogleDriveUtils.is_directory(child) and child_id not in folder_paths:
+                    folder_paths[child_id] = child_path
+                    next_level.append(child_id)
+            level = next_level
+
+    @staticmethod
+    def get_local_directory(name, kind="caches"):
+        """
+        Directory on the DSS node where the plugin can keep local state.
+        kind is the DSS data directory it goes in: caches for data that can be rebuilt, run for runtime state
+        """
+        dip_home = os.environ.get("DIP_HOME")
+        if dip_home:
+            base_directory = os.path.join(dip_home, kind)
+        else:
+            base_directory = tempfile.gettempdir()
+        return os.path.join(base_directory, GoogleDriveUtils.LOCAL_DIRECTORY_NAME, name)
+
     @staticmethod
     def get_root_id(config):
         root_id = config.get("googledrive_root_id")
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataMirror():
+    """
+    Local SQLite copy of the metadata of every item below a Google Drive root, kept current with the changes feed
+
+    :param session: the GoogleDriveSession used to reach Google Drive
+    :param max_staleness: number of seconds the mirror is trusted before the changes feed is checked again
+    :param directory: where the SQLite databases are stored, one per root and Google account
+    """
+    DEFAULT_MAX_STALENESS = 60
+    SQL_MAX_VARIABLES = 500
+    CHANGES_FIELDS = "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, size, parents, mimeType, createdTime, modifiedTime, md5Checksum, trashed))"
+    PAGE_TOKEN = "page_token"
+    LAST_SYNC = "last_sync"
+
+    def __init__(self, session, max_staleness=DEFAULT_MAX_STALENESS, directory=None):
+        self.session = session
+        self.max_staleness = max_staleness
+        self.directory = directory or gdu.get_local_directory("metadata-mirrors")
+        self.connection = None
+        self.root_id = None
+        self.stale = True
+        self.lock = threading.RLock()
+
+    def open(self):
+        if self.connection is not None:
+            return
+        session = self.session
+        root = session.googledrive_execute(
+            lambda: session.drive.files().get(fileId=session.root_id, fields=gdu.ID, supportsAllDrives=True),
+            "get"
+        )
+        self.root_id = gdu.get_id(root)
+        about = session.googledrive_execute(lambda: session.drive.about().get(fields="user(permissionId)"), "about")
+        # One database per root and per account, so that nobody sees items listed with someone else's access rights
+        key = hashlib.sha256("{}/{}".format(self.root_id, about["user"]["permissionId"]).encode("utf-8")).hexdigest()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        database_path = os.path.join(self.directory, "{}.sqlite".format(key))
+        logger.info("Opening metadata mirror {} for root {}".format(database_path, self.root_id))
+        self.connection = sqlite3.connect(database_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS items (id TEXT, parent_id TEXT, name TEXT, is_folder INTEGER, item TEXT, PRIMARY KEY (id, parent_id))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS items_by_parent ON items (parent_id, name)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def record_item(self, item):
+        """
+        Write an item returned by one of our own create, update or move calls, without waiting for the changes feed
+        """
+        with self.lock:
+            self.open()
+            with self.connection:
+                parent_ids = [parent_id for parent_id in item.get(gdu.PARENTS, []) if self.is_known_folder(parent_id)]
+                if parent_ids:
+                    self.upsert(item, parent_ids)
+                else:
+                    # Moved out of the mirrored tree
+                    self.delete_subtree(gdu.get_id(item))
+
+    def record_removal(self, item_ids):
+        """
+        Remove items we trashed, and everything below them
+        """
+        with self.lock:
+            self.open()
+            with self.connection:
+                for item_id in item_ids:
+                    self.delete_subtree(item_id)
+
+    def sync_if_stale(self):
+        with self.lock:
+            self.open()
+            last_sync = self.get_state(self.LAST_SYNC)
+            if not self.stale and last_sync is not None and time.time() - float(last_sync) < self.max_staleness:
+                return
+            page_token = self.get_state(self.PAGE_TOKEN)
+            if page_token is None:
+                self.seed()
+            else:
+                self.apply_changes(page_token)
+            self.stale = False
+
+    def seed(self):
+        logger.info("Seeding metadata mirror of {}".format(self.root_id))
+        page_token = self.get_start_page_token()
+        entries = self.list_subtrees([self.root_id])
+        # A single transaction, so that other processes never read a partly seeded mirror
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.get_state(self.PAGE_TOKEN) is not None:
+                logger.info("Metadata mirror of {} seeded by another process meanwhile".format(self.root_id))
+                return
+            self.connection.execute("DELETE FROM items")
+            self.write_subtrees([self.root_id], entries)
+            self.set_state(self.PAGE_TOKEN, page_token)
+            self.set_state(self.LAST_SYNC, time.time())
+
+    def get_start_page_token(self):
+        session = self.session
+        response = session.googledrive_execute(
+            lambda: session.drive.changes().getStartPageToken(supportsAllDrives=True),
+            "changes"
+        )
+        return response.get("startPageToken")
+
+    def apply_changes(self, page_token):
+        changes = []
+        new_page_token = None
+        session = self.session
+        while new_page_token is None:
+            response = session.googledrive_execute(
+                lambda: session.drive.changes().list(
+                    pageToken=page_token,
+                    fields=self.CHANGES_FIELDS,
+                    pageSize=gdu.MAX_PAGE_SIZE,
+                    includeRemoved=True,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True
+                ),
+                "changes"
+            )
+            changes.extend(response.get("changes", []))
+            new_page_token = response.get("newStartPageToken")
+            page_token = response.get("nextPageToken")
+        logger.info("Applying {} changes to metadata mirror of {}".format(len(changes), self.root_id))
+        with self.connection:
+            pending = []
+            for change in changes:
+                item = change.get("file")
+                if change.get("removed") or item is None or item.get("trashed"):
+                    self.delete_subtree(change.get("fileId"))
+                else:
+                    pending.append(item)
+            # The feed only lists each item at its latest change, so a child can come before its new parent folder
+            new_folder_ids = []
+            progress = True
+            while pending and progress:
+                progress = False
+                still_pending = []
+                for item in pending:
+                    parent_ids = [parent_id for parent_id in item.get(gdu.PARENTS, []) if self.is_known_folder(parent_id)]
+                    if parent_ids:
+                        if gdu.is_directory(item) and not self.is_known_folder(gdu.get_id(item)):
+                            new_folder_ids.append(gdu.get_id(item))
+                        self.upsert(item, parent_ids)
+                        progress = True
+                    else:
+                        still_pending.append(item)
+                pending = still_pending
+            for item in pending:
+                # Moved out of the mirrored tree, or never was in it
+                self.delete_subtree(gdu.get_id(item))
+        # Folders moved or restored into the tree come with content that did not change.
+        # The page token is only saved afterwards, as replaying changes is harmless
+        self.insert_subtrees(new_folder_ids)
+        with self.connection:
+            self.set_state(self.PAGE_TOKEN, new_page_token)
+            self.set_state(self.LAST_SYNC, time.time())
+
+    def insert_subtrees(self, folder_ids):
+        if not folder_ids:
+            return
+        entries = self.list_subtrees(folder_ids)
+        with self.connection:
+            self.write_subtrees(folder_ids, entries)
+
+    def list_subtrees(self, folder_ids):
+        # Listed before writing, to keep the database unlocked during the API calls
+        folders = [{gdu.ID: folder_id} for folder_id in folder_ids]
+        return list(self.session.googledrive_list_tree(folders))
+
+    def write_subtrees(self, folder_ids, entries):
+        known_folder_ids = set(folder_ids)
+        for path, item in entries:
+            parent_ids = [parent_id for parent_id in item.get(gdu.PARENTS, []) if parent_id in known_folder_ids]
+            if parent_ids:
+                self.upsert(item, parent_ids)
+                if gdu.is_directory(item):
+                    known_folder_ids.add(gdu.get_id(item))
+
+    def upsert(self, item, parent_ids):
+        item = dict((key, value) for key, value in item.items() if key != "trashed")
+        item_id = gdu.get_id(item)
+        self.connection.execute("DELETE FROM items WHERE id = ?", (item_id,))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO items (id, parent_id, name, is_folder, item) VALUES (?, ?, ?, ?, ?)",
+            [(item_id, parent_id, gdu.get_name(item), gdu.is_directory(item), json.dumps(item)) for parent_id in parent_ids]
+        )
+
+    def delete_subtree(self, item_id):
+        level = [item_id]
+        while level:
+            children = []
+            for ids in self.split(level):
+                placeholders = ",".join("?" * len(ids))
+                children.extend(
+                    row[0] for row in self.connection.execute(
+                        "SELECT DISTINCT id FROM items WHERE parent_id IN ({})".format(placeholders), ids
+                    )
+                )
+                self.connection.execute("DELETE FROM items WHERE id IN ({})".format(placeholders), ids)
+            level = children
+
+    def is_known_folder(self, folder_id):
+        if folder_id == self.root_id:
+            return True
+        row = self.connection.execute("SELECT 1 FROM items WHERE id = ? AND is_folder = 1 LIMIT 1", (folder_id,)).fetchone()
+        return row is not None
+
+    def get_state(self, key):
+        row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def split(self, ids):
+        return [ids[start:start + self.SQL_MAX_VARIABLES] for start in range(0, len(ids), self.SQL_MAX_VARIABLES)]
+
+    def resolve_id(self, folder_id):
+        if folder_id == self.session.root_id:
+            return self.root_id
+        return folder_id
+
+    def get_children_of(self, folder_ids, name=None):
+        children = []
+        for ids in self.split(folder_ids):
+            placeholders = ",".join("?" * len(ids))
+            query = "SELECT parent_id, item FROM items WHERE parent_id IN ({})".format(placeholders)
+            parameters = list(ids)
+            if name is not None:
+                query = query + " AND name = ?"
+                parameters.append(name)
+            children.extend((row[0], json.loads(row[1])) for row in self.connection.execute(query, parameters))
+        return children
+
+    def get_items_from_path(self, tokens):
+        with self.lock:
+            self.sync_if_stale()
+            parent_ids = [self.root_id]
+            items = []
+            for token in tokens:
+                items = [item for parent_id, item in self.get_children_of(parent_ids, name=token)]
+                if not items:
+                    return []
+                parent_ids = gdu.get_files_ids(items)
+            return items
+
+    def get_children(self, folder_id):
+        with self.lock:
+            self.sync_if_stale()
+            return [item for parent_id, item in self.get_children_of([self.resolve_id(folder_id)])]
+
+    def list_tree(self, folder_id):
+        with self.lock:
+            self.sync_if_stale()
+            # Walked under the lock, as the connection is shared
+            return list(gdu.walk_tree([self.resolve_id(folder_id)], self.get_children_of))
@@ -0,0 +1,111 @@
+import copy
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SessionMetrics():
+    """
+    Counters of the Google Drive API usage of one session: calls by API method with their latencies,
+    pages listed, retries, time spent waiting and bytes transferred
+
+    :param latency_buckets: upper bounds in seconds of the latency histogram buckets
+    """
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+    COUNTERS = [
+        "pages",
+        "retries",
+        "backoff_seconds",
+        "throttle_seconds",
+        "bytes_uploaded",
+        "bytes_downloaded",
+        "content_cache_hits",
+        "content_cache_misses"
+    ]
+
+    def __init__(self, latency_buckets=None):
+        self.latency_buckets = latency_buckets or self.LATENCY_BUCKETS
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.api_calls = {}
+            self.operations = {}
+            self.counters = dict((name, 0) for name in self.COUNTERS)
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def record_api_call(self, method, seconds, failed=False):
+        with self.lock:
+            call = self.api_calls.get(method)
+            if call is None:
+                call = {
+                    "count": 0,
+                    "errors": 0,
+                    "total_seconds": 0,
+                    "max_seconds": 0,
+                    "latency_histogram": [0] * (len(self.latency_buckets) + 1)
+                }
+                self.api_calls[method] = call
+            call["count"] += 1
+            if failed:
+                call["errors"] += 1
+            call["total_seconds"] += seconds
+            call["max_seconds"] = max(call["max_seconds"], seconds)
+            call["latency_histogram"][self.get_bucket(seconds)] += 1
+
+    def record_operation(self, name, seconds):
+        with self.lock:
+            operation = self.operations.setdefault(name, {"count": 0, "total_seconds": 0})
+            operation["count"] += 1
+            operation["total_seconds"] += seconds
+
+    def get_bucket(self, seconds):
+        for index, upper_bound in enumerate(self.latency_buckets):
+            if seconds <= upper_bound:
+                return index
+        return len(self.latency_buckets)
+
+    @contextmanager
+    def api_call(self, method):
+        start = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record_api_call(method, time.time() - start, failed=failed)
+
+    @contextmanager
+    def operation(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record_operation(name, time.time() - start)
+
+    def get_bucket_labels(self):
+        labels = ["<={}s".format(upper_bound) for upper_bound in self.latency_buckets]
+        labels.append(">{}s".format(self.latency_buckets[-1]))
+        return labels
+
+    def get_summary(self):
+        """
+        Return a copy of all the metrics as a dict, latency histograms being keyed by bucket label
+        """
+        labels = self.get_bucket_labels()
+        with self.lock:
+            summary = copy.deepcopy(self.counters)
+            summary["api_calls"] = {}
+            for method, call in self.api_calls.items():
+                call = copy.deepcopy(call)
+                call["latency_histogram"] = dict(
+                    (label, count) for label, count in zip(labels, call["latency_histogram"]) if count
+                )
+                summary["api_calls"][method] = call
+            summary["operations"] = copy.deepcopy(self.operations)
+        summary["total_api_calls"] = sum(call["count"] for call in summary["api_calls"].values())
+        return summary
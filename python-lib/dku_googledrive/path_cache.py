@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PathCache():
+    """
+    Bounded LRU cache mapping normalized Drive paths to the items found at that path
+
+    :param max_size: maximum number of paths kept in the cache
+    :param ttl: number of seconds after which an entry is considered stale
+    """
+    DEFAULT_MAX_SIZE = 10000
+    DEFAULT_TTL = 30
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(tokens):
+        return '/' + '/'.join(token for token in tokens if token and token != '/')
+
+    @staticmethod
+    def normalize(path):
+        return PathCache.get_key(path.split('/'))
+
+    def get(self, tokens):
+        key = self.get_key(tokens)
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        timestamp, items = entry
+        if time.time() - timestamp > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return items
+
+    def set(self, tokens, items):
+        if self.max_size <= 0:
+            return
+        key = self.get_key(tokens)
+        with self.lock:
+            self.entries[key] = (time.time(), items)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_longest_prefix(self, tokens):
+        """
+        Return (depth, items) for the longest prefix of tokens present in the cache, (0, None) if none is
+        """
+        with self.lock:
+            for depth in range(len(tokens), 0, -1):
+                items = self._get(self.get_key(tokens[:depth]))
+                if items is not None:
+                    return depth, items
+        return 0, None
+
+    def invalidate(self, path):
+        """
+        Drop the entry for path and for everything below it
+        """
+        key = self.normalize(path)
+        if key == '/':
+            self.clear()
+            return
+        prefix = key + '/'
+        with self.lock:
+            stale_keys = [cached_key for cached_key in self.entries if cached_key == key or cached_key.startswith(prefix)]
+            for stale_key in stale_keys:
+                del self.entries[stale_key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
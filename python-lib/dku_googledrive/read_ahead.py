@@ -0,0 +1,155 @@
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+
+logger = logging.getLogger(__name__)
+
+
+class ReadAhead():
+    """
+    Downloads the files following the one being read in the last enumerated listing, into spools that later reads are served from
+
+    :param session: the GoogleDriveSession used to download
+    :param depth: number of files downloaded ahead of the one being read
+    :param max_spooled_bytes: bound on the total size of the files downloaded ahead and not read yet
+    :param max_memory_per_file: size above which a spooled file is moved from memory to a local temporary file
+    """
+    def __init__(self, session, depth, max_spooled_bytes, max_memory_per_file=gdu.READ_AHEAD_MAX_MEMORY_PER_FILE):
+        self.session = session
+        self.depth = depth
+        self.max_spooled_bytes = max_spooled_bytes
+        self.max_memory_per_file = max_memory_per_file
+        self.executor = ThreadPoolExecutor(max_workers=depth)
+        self.lock = threading.Lock()
+        self.listing = []
+        self.positions = {}
+        self.prefetches = {}
+        self.read_paths = set()
+        self.prefetch_limit = None
+        self.spooled_bytes = 0
+
+    def set_listing(self, entries):
+        """
+        Remember entries, a list of (full_path, item) tuples in the order DSS is expected to read them
+        """
+        with self.lock:
+            self.discard_prefetches()
+            self.listing = [(full_path, item) for full_path, item in entries if gdu.is_file(item)]
+            self.positions = dict((full_path, index) for index, (full_path, item) in enumerate(self.listing))
+            self.read_paths = set()
+
+    def clear(self):
+        with self.lock:
+            self.discard_prefetches()
+            self.listing = []
+            self.positions = {}
+            self.read_paths = set()
+
+    def read(self, full_path, stream, limit=None):
+        """
+        Write the content of full_path to stream if it is part of the listing, and start downloading the next files.
+        Return False when full_path is not in the listing, the caller then reading it the usual way
+        """
+        if limit is not None and limit <= 0:
+            limit = None
+        with self.lock:
+            index = self.positions.get(full_path)
+            if index is None:
+                return False
+            item = self.listing[index][1]
+            # Previews only read the first bytes of each file, so the next files are downloaded up to the same limit
+            self.prefetch_limit = limit
+            prefetch = self.prefetches.pop(full_path, None)
+            if prefetch is not None and not covers(prefetch[2], limit):
+                self.discard_prefetch(prefetch)
+                prefetch = None
+            self.read_paths.add(full_path)
+            self.schedule(index + 1)
+        if prefetch is None:
+            self.session.googledrive_download(item, stream, limit=limit)
+            return True
+        future, size, prefetch_limit = prefetch
+        try:
+            spool = future.result()
+        except Exception as err:
+            logger.warning("Read ahead of {} failed ({}), downloading it again".format(full_path, err))
+            self.release(size)
+            self.session.googledrive_download(item, stream, limit=limit)
+            return True
+        try:
+            spool.seek(0)
+            if limit is not None:
+                stream.write(spool.read(limit))
+            else:
+                shutil.copyfileobj(spool, stream)
+        finally:
+            spool.close()
+            self.release(size)
+        with self.lock:
+            self.schedule(index + 1)
+        return True
+
+    def schedule(self, start):
+        # Called with the lock held
+        for full_path, item in self.listing[start:start + self.depth]:
+            # Exports have no known size, they are read when asked for
+            if full_path in self.read_paths or gdu.is_file_google_doc(item):
+                continue
+            if full_path in self.prefetches:
+                if covers(self.prefetches[full_path][2], self.prefetch_limit):
+                    continue
+                self.discard_prefetch(self.prefetches.pop(full_path))
+            size = gdu.file_size(item)
+            if self.prefetch_limit is not None:
+                size = min(size, self.prefetch_limit)
+            if self.spooled_bytes + size > self.max_spooled_bytes:
+                break
+            self.spooled_bytes = self.spooled_bytes + size
+            self.prefetches[full_path] = (self.executor.submit(self.download, item, self.prefetch_limit), size, self.prefetch_limit)
+
+    def download(self, item, limit=None):
+        spool = tempfile.SpooledTemporaryFile(max_size=self.max_memory_per_file)
+        try:
+            self.session.googledrive_download(item, spool, limit=limit)
+        except Exception:
+            spool.close()
+            raise
+        return spool
+
+    def release(self, size):
+        with self.lock:
+            self.spooled_bytes = self.spooled_bytes - size
+
+    def discard_prefetches(self):
+        # Called with the lock held
+        for prefetch in self.prefetches.values():
+            self.discard_prefetch(prefetch)
+        self.prefetches = {}
+
+    def discard_prefetch(self, prefetch):
+        # Called with the lock held
+        future, size, limit = prefetch
+        if not future.cancel():
+            future.add_done_callback(close_spool)
+        self.spooled_bytes = self.spooled_bytes - size
+
+    def close(self):
+        with self.lock:
+            self.discard_prefetches()
+        self.executor.shutdown(wait=True)
+
+
+def covers(prefetch_limit, limit):
+    """
+    Whether a file downloaded up to prefetch_limit bytes can serve a read of up to limit bytes, None meaning the whole file
+    """
+    return prefetch_limit is None or (limit is not None and limit <= prefetch_limit)
+
+
+def close_spool(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -0,0 +1,183 @@
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RetryPolicy():
+    """
+    Decides which Google Drive errors are worth retrying and how long to wait before the next attempt
+
+    :param max_attempts: maximum number of attempts of one operation
+    :param base_delay: seconds waited after the first failure, doubled after each new failure
+    :param max_delay: upper bound of a single wait, in seconds
+    """
+    RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+    RETRYABLE_REASONS = [
+        "rateLimitExceeded",
+        "userRateLimitExceeded",
+        "sharingRateLimitExceeded",
+        "backendError",
+        "internalError"
+    ]
+
+    def __init__(self, max_attempts=5, base_delay=1, max_delay=64):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def get_reason(err):
+        try:
+            content = err.content
+            if isinstance(content, bytes):
+                content = content.decode("utf-8")
+            return json.loads(content).get('error').get('errors')[0].get('reason', "")
+        except (ValueError, AttributeError, TypeError, IndexError):
+            return ""
+
+    def is_retryable(self, err):
+        status = err.resp.status
+        if status == 403:
+            # 403 is used both for rate limits and for missing permissions, which will not go away
+            return self.get_reason(err) in self.RETRYABLE_REASONS
+        return status in self.RETRYABLE_STATUSES
+
+    def get_delay(self, attempt, err=None):
+        """
+        Seconds to wait after the given failed attempt (0 based): exponential backoff with jitter,
+        or what the server asked for in Retry-After if that is longer
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = delay / 2.0 + random.uniform(0, delay / 2.0)
+        retry_after = self.get_retry_after(err)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    @staticmethod
+    def get_retry_after(err):
+        if err is None:
+            return None
+        value = err.resp.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(mktime_tz(date) - time.time(), 0)
+
+
+class TokenBucket():
+    """
+    Client-side rate limiter handing out request permits at a steady rate
+
+    :param rate: permits added per second
+    :param capacity: maximum number of permits that can be saved up for a burst
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self, permits=1):
+        """
+        Block until permits are available. Return the number of seconds spent waiting
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                wait = self.take(permits)
+            if wait == 0:
+                return waited
+            time.sleep(wait)
+            waited = waited + wait
+
+    def take(self, permits):
+        """
+        Take permits if the bucket holds enough of them and return 0, else return the number of seconds to wait
+        """
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + max(now - self.timestamp, 0) * self.rate)
+        self.timestamp = now
+        # Requests larger than the bucket go through once it is full, instead of waiting forever
+        needed = min(permits, self.capacity)
+        if self.tokens >= needed:
+            self.tokens = self.tokens - permits
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def close(self):
+        pass
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a file, so that every process of the node using the same file
+    shares one request rate. The file is locked while permits are taken
+
+    :param path: path of the state file, created if missing
+    :param rate: permits added per second, for all the processes together
+    :param capacity: maximum number of permits that can be saved up for a burst
+    """
+    def __init__(self, path, rate, capacity=None):
+        super(SharedTokenBucket, self).__init__(rate, capacity)
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        self.path = path
+        self.file_descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+    @staticmethod
+    def is_supported():
+        return fcntl is not None
+
+    def take(self, permits):
+        # flock is held by the open file, shared by the threads of this process, hence the thread lock in acquire
+        fcntl.flock(self.file_descriptor, fcntl.LOCK_EX)
+        try:
+            self.load()
+            wait = super(SharedTokenBucket, self).take(permits)
+            self.save()
+            return wait
+        finally:
+            fcntl.flock(self.file_descriptor, fcntl.LOCK_UN)
+
+    def load(self):
+        os.lseek(self.file_descriptor, 0, os.SEEK_SET)
+        content = os.read(self.file_descriptor, 4096)
+        try:
+            state = json.loads(content.decode("utf-8"))
+            self.tokens = min(float(state["tokens"]), self.capacity)
+            self.timestamp = float(state["timestamp"])
+        except (ValueError, KeyError, TypeError):
+            # New or damaged file, start with a full bucket
+            self.tokens = self.capacity
+            self.timestamp = time.time()
+
+    def save(self):
+        content = json.dumps({"tokens": self.tokens, "timestamp": self.timestamp}).encode("utf-8")
+        os.lseek(self.file_descriptor, 0, os.SEEK_SET)
+        os.ftruncate(self.file_descriptor, 0)
+        os.write(self.file_descriptor, content)
+
+    def close(self):
+        if self.file_descriptor is not None:
+            os.close(self.file_descriptor)
+            self.file_descriptor = None
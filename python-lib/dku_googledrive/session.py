@@ -1,24 +1,35 @@
+import ast
 import logging
-import shutil
-import os
 import json
-from random import randrange
+import hashlib
+import http.client
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
-from apiclient.discovery import build
+import httplib2
 from oauth2client.service_account import ServiceAccountCredentials
-from oauth2client.client import AccessTokenCredentials
-from httplib2 import Http
+from oauth2client.client import AccessTokenCredentials, AccessTokenCredentialsError
 from mimetypes import MimeTypes
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 from googleapiclient.errors import HttpError
 from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
 from time import sleep
-from dku_googledrive.memory_cache import MemoryCache
-
-try:
-    from BytesIO import BytesIO  # for Python 2
-except ImportError:
-    from io import BytesIO  # for Python 3
+from dku_googledrive.client_pool import client_pool
+from dku_googledrive.metrics import SessionMetrics
+from dku_googledrive.path_cache import PathCache
+from dku_googledrive.retry_policy import RetryPolicy, TokenBucket, SharedTokenBucket
+from dku_googledrive.metadata_mirror import MetadataMirror
+from dku_googledrive.drive_snapshot import DriveSnapshot
+from dku_googledrive.read_ahead import ReadAhead
+from dku_googledrive.content_cache import ContentCache, TeeStreamWriter
+from dku_googledrive.streaming_upload import StreamingMediaUpload, read_prefix
+from dku_googledrive.transport import PooledHttp
+from dku_googledrive.write_behind import WriteBehind
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
@@ -29,6 +40,48 @@ class GoogleDriveSessionError(ValueError):
     pass
 
 
+# OAuth client ID of the access tokens already looked up, keyed by the hash of the token
+_oauth_client_ids = {}
+_oauth_client_ids_lock = threading.Lock()
+
+
+class LimitedStreamWriter():
+    """
+    Write to stream, dropping everything past the first limit bytes
+
+    :param stream: the stream to write to
+    :param limit: maximum number of bytes written to stream
+    """
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def write(self, data):
+        if self.remaining <= 0:
+            return
+        data = data[:self.remaining]
+        self.remaining = self.remaining - len(data)
+        self.stream.write(data)
+
+    def is_full(self):
+        return self.remaining <= 0
+
+
+class CountingStreamWriter():
+    """
+    Write to stream, counting the bytes written
+
+    :param stream: the stream to write to
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = 0
+
+    def write(self, data):
+        self.written = self.written + len(data)
+        return self.stream.write(data)
+
+
 class GoogleDriveSession():
     """
     Google Drive Session
@@ -44,121 +97,728 @@ class GoogleDriveSession():
         self.output_google_sheets_as_xlsx = config.get("output_google_sheets_as_xlsx", False)
         self.nodir_mode = False  # Future development
 
+        connect_timeout = float(config.get("connect_timeout") or gdu.DEFAULT_CONNECT_TIMEOUT)
+        read_timeout = float(config.get("read_timeout") or gdu.DEFAULT_READ_TIMEOUT)
+        transport_settings = [connect_timeout, read_timeout]
+
+        def create_http():
+            return PooledHttp(connect_timeout=connect_timeout, read_timeout=read_timeout)
+
         if self.auth_type == "oauth":
             self.access_token = config.get("oauth_credentials")["access_token"]
-            credentials = AccessTokenCredentials(self.access_token, "dss-googledrive-plugin/2.0")
-            http_auth = credentials.authorize(Http())
+            self.clients = client_pool.get(
+                [self.access_token, transport_settings],
+                lambda: AccessTokenCredentials(self.access_token, gdu.USER_AGENT),
+                create_http
+            )
+            quota_key = None
         else:
-            credentials_dict = eval(connection['credentials'])
-            credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scopes)
-            http_auth = credentials.authorize(Http())
+            credentials_dict = self.get_credentials_dict(connection['credentials'])
+            self.clients = client_pool.get(
+                [credentials_dict, transport_settings],
+                lambda: ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scopes),
+                create_http
+            )
+            quota_key = credentials_dict.get("project_id") or credentials_dict.get("client_email") or "service-account"
         self.root_id = config.get("googledrive_root_id")
         if not self.root_id:
             self.root_id = gdu.ROOT_ID
-        self.max_attempts = 5
+        self.metrics = SessionMetrics()
+        self.real_root_id = None
+        self.retry_policy = RetryPolicy(max_attempts=5)
+        queries_per_100_seconds = config.get("queries_per_100_seconds")
+        if queries_per_100_seconds is None:
+            queries_per_100_seconds = gdu.DEFAULT_QUERIES_PER_100_SECONDS
+        self.rate_limiter = None
+        if queries_per_100_seconds:
+            if quota_key is None:
+                def get_quota_key():
+                    return self.get_oauth_quota_key(self.access_token, create_http())
+            else:
+                def get_quota_key():
+                    return quota_key
+            self.rate_limiter = self.get_rate_limiter(queries_per_100_seconds / 100.0, get_quota_key, config.get("node_wide_quota", True))
         self.root_id = gdu.get_root_id(config)
-        self.drive = build(
-            gdu.API,
-            gdu.API_VERSION,
-            http=http_auth,
-            cache=MemoryCache()  # Fix for ImportError messages https://github.com/googleapis/google-api-python-client/issues/325
-        )
+        self.max_parallel_requests = max(int(config.get("max_parallel_requests") or gdu.DEFAULT_MAX_PARALLEL_REQUESTS), 1)
+        self.upload_chunk_size = max(int(config.get("upload_chunk_size") or gdu.DEFAULT_UPLOAD_CHUNK_SIZE), 1) * gdu.MEGABYTE
+        multipart_upload_threshold = config.get("multipart_upload_threshold")
+        if multipart_upload_threshold is None:
+            multipart_upload_threshold = gdu.DEFAULT_MULTIPART_UPLOAD_THRESHOLD
+        self.multipart_upload_threshold = max(int(multipart_upload_threshold), 0) * gdu.MEGABYTE
+        self.executor = None
+        self.path_cache = PathCache()
+        self.known_directories = PathCache(ttl=gdu.KNOWN_DIRECTORIES_TTL)
+        self.directory_creation_locks = {}
+        self.directory_creation_locks_lock = threading.Lock()
+        self.folder_indexes = {}
+        self.folder_listings = {}
+        self.folder_indexes_lock = threading.Lock()
+        self.metadata_mirror = None
+        if config.get("use_metadata_mirror"):
+            max_staleness = config.get("metadata_mirror_max_staleness")
+            if max_staleness is None:
+                max_staleness = MetadataMirror.DEFAULT_MAX_STALENESS
+            self.metadata_mirror = MetadataMirror(self, max_staleness=int(max_staleness))
+        self.drive_snapshot = None
+        if config.get("shared_drive_flat_sweep") and self.root_id != gdu.ROOT_ID:
+            self.drive_snapshot = DriveSnapshot(self, self.root_id)
+        self.content_cache = None
+        if config.get("use_content_cache"):
+            content_cache_size = int(config.get("content_cache_size") or gdu.DEFAULT_CONTENT_CACHE_SIZE)
+            self.content_cache = ContentCache(gdu.get_local_directory("content-cache"), content_cache_size * gdu.MEGABYTE)
+        self.read_ahead = None
+        read_ahead_files = int(config.get("read_ahead_files") or 0)
+        if read_ahead_files > 0:
+            read_ahead_buffer_size = int(config.get("read_ahead_buffer_size") or gdu.DEFAULT_READ_AHEAD_BUFFER_SIZE)
+            self.read_ahead = ReadAhead(self, read_ahead_files, read_ahead_buffer_size * gdu.MEGABYTE)
+        self.write_behind = None
+        write_behind_uploads = int(config.get("write_behind_uploads") or 0)
+        if write_behind_uploads > 0:
+            write_behind_buffer_size = int(config.get("write_behind_buffer_size") or gdu.DEFAULT_WRITE_BEHIND_BUFFER_SIZE)
+            self.write_behind = WriteBehind(self, write_behind_uploads, write_behind_buffer_size * gdu.MEGABYTE)
+
+    @staticmethod
+    def get_credentials_dict(credentials):
+        if isinstance(credentials, dict):
+            return credentials
+        try:
+            credentials_dict = json.loads(credentials)
+        except ValueError:
+            try:
+                # Credentials pasted as a Python dict literal used to be accepted
+                credentials_dict = ast.literal_eval(credentials)
+            except (ValueError, SyntaxError):
+                credentials_dict = None
+        if not isinstance(credentials_dict, dict):
+            raise GoogleDriveSessionError("The service account credentials of the preset are not a valid JSON object")
+        return credentials_dict
+
+    @staticmethod
+    def get_oauth_quota_key(access_token, http):
+        """
+        Return the quota key of an OAuth access token: the OAuth client it was issued to, so that the tokens of one app
+        share its quota and those of other apps do not. A token whose client cannot be found only limits itself.
+        The client is looked up once per token and process, failures included
+        """
+        token_hash = hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+        with _oauth_client_ids_lock:
+            is_known = token_hash in _oauth_client_ids
+            client_id = _oauth_client_ids.get(token_hash)
+        if not is_known:
+            try:
+                # Posted, so that the token does not end up in URLs and their logs
+                response, content = http.request(
+                    gdu.TOKEN_INFO_URL,
+                    method="POST",
+                    body=urlencode({"access_token": access_token}),
+                    headers={"content-type": "application/x-www-form-urlencoded"}
+                )
+                if response.status == 200:
+                    token_info = json.loads(content.decode("utf-8"))
+                    client_id = token_info.get("azp") or token_info.get("aud")
+            except (IOError, OSError, ValueError, httplib2.HttpLib2Error) as err:
+                logger.warning("Could not find the OAuth client of the access token ({})".format(err))
+            if client_id is None:
+                logger.warning("OAuth client of the access token unknown, its API quota is not shared with other tokens")
+            with _oauth_client_ids_lock:
+                _oauth_client_ids[token_hash] = client_id
+        if client_id is None:
+            return "oauth-token:" + token_hash
+        return "oauth-client:" + client_id
+
+    @staticmethod
+    def get_rate_limiter(rate, get_quota_key, node_wide):
+        """
+        The quota is shared by every process of the node using the same quota key, a Google Cloud project or an OAuth client,
+        through a state file in the DSS run directory. get_quota_key() is only called then, as it may call Google
+        """
+        if node_wide and SharedTokenBucket.is_supported():
+            file_name = "{}.json".format(hashlib.sha256(get_quota_key().encode("utf-8")).hexdigest())
+            path = os.path.join(gdu.get_local_directory("quotas", kind="run"), file_name)
+            try:
+                return SharedTokenBucket(path, rate)
+            except (IOError, OSError) as err:
+                logger.warning("Could not share the API quota through {} ({}), limiting this process only".format(path, err))
+        return TokenBucket(rate)
+
+    @property
+    def max_attempts(self):
+        # The retry loops all stop at the attempts limit of the retry policy
+        return self.retry_policy.max_attempts
+
+    @property
+    def credentials(self):
+        return self.clients.credentials
+
+    @property
+    def drive(self):
+        # Shared by all threads and by the other sessions of the process using the same credentials
+        return self.clients.get_drive()
+
+    def map_parallel(self, function, items):
+        """
+        Apply function to each of items using up to max_parallel_requests threads. Results keep the order of items
+        """
+        items = list(items)
+        if self.max_parallel_requests == 1 or len(items) < 2:
+            return [function(item) for item in items]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_parallel_requests)
+        return list(self.executor.map(function, items))
+
+    def close(self):
+        try:
+            # Waits for the background uploads, raising if one failed
+            if self.write_behind is not None:
+                self.write_behind.close()
+        finally:
+            if self.read_ahead is not None:
+                self.read_ahead.close()
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+            if self.rate_limiter is not None:
+                self.rate_limiter.close()
+            logger.info("Google Drive session metrics: {}".format(json.dumps(self.metrics.get_summary(), sort_keys=True)))
 
     def get_item_from_path(self, path_and_file):
+        items = self.get_items_from_path(path_and_file)
+        if not items:
+            return None
+        return items[0]
+
+    def get_items_from_path(self, path_and_file):
+        """
+        Return every item found at path_and_file, as Google Drive allows several items with the same name
+        """
+        with self.metrics.operation("resolve_path"):
+            return self.resolve_items_from_path(path_and_file)
+
+    def resolve_items_from_path(self, path_and_file):
         tokens = gdu.split_path(path_and_file)
         if len(tokens) == 1:
-            return {
+            return [{
                 gdu.MIME_TYPE: gdu.FOLDER,
                 gdu.SIZE: u'0',
                 gdu.ID: self.root_id,
                 gdu.NAME: u'/'
-            }
-        parent_ids = [self.root_id]
+            }]
+        tokens = [token for token in tokens if token != '/']
+        if self.metadata_mirror is not None:
+            return self.metadata_mirror.get_items_from_path(tokens)
 
-        for token in tokens:
-            if token == '/':
-                token = ''
-                continue
+        # Resume the walk from the deepest path prefix we already resolved
+        depth, files = self.path_cache.get_longest_prefix(tokens)
+        if depth == len(tokens) and any(gdu.MODIFIED_TIME not in file for file in files):
+            # Cached as an intermediate folder, without the fields the path itself is returned with
+            depth = depth - 1
+            files = self.path_cache.get(tokens[:depth]) if depth > 0 else None
+            if files is None:
+                depth = 0
+        if depth == len(tokens):
+            return files
+        if depth == 0:
+            parent_ids = [self.root_id]
+        else:
+            parent_ids = gdu.get_files_ids(files)
+
+        if len(tokens) - depth > 2:
+            files = self.resolve_by_names(tokens, depth, parent_ids)
+            if files is not None:
+                return files
+        return self.resolve_level_by_level(tokens, depth, parent_ids)
+
+    def resolve_by_names(self, tokens, depth, parent_ids):
+        """
+        Resolve the folders of tokens below the folders parent_ids of depth with a few queries on all their names at once,
+        rebuilding the parent chains locally, then look the last token up in the folders found.
+        Return None when the candidate folders are too many to be fetched cheaply
+        """
+        queries = self.get_path_candidates_queries(tokens, depth, parent_ids)
+        if queries is None:
+            return None
+        candidates = []
+        for query in queries:
+            query_candidates = self.googledrive_list_candidates(query)
+            if query_candidates is None:
+                return None
+            candidates.extend(query_candidates)
+        # Candidates with the first name all match the first clause, unless the name is also one of the next ones
+        is_first_name_repeated = tokens[depth] in tokens[depth + 1:-1]
+        if depth == 0 and is_first_name_repeated:
+            # Items of the top level have the real ID of the root in their parents, not its alias
+            parent_ids = [self.get_real_root_id()]
+        for index in range(depth, len(tokens) - 1):
+            token = tokens[index]
+            parent_id_set = set(parent_ids)
+            is_in_parents = index > depth or is_first_name_repeated
+            # Every candidate with this name below one of the previous level items, to keep duplicates like the walk does
+            folders = [
+                file for file in candidates
+                if gdu.get_name(file) == token and (not is_in_parents or parent_id_set.intersection(file.get(gdu.PARENTS, [])))
+            ]
+            if len(folders) == 0:
+                return []
+            self.path_cache.set(tokens[:index + 1], folders)
+            parent_ids = gdu.get_files_ids(folders)
+        # The last name is often shared by many folders, as in partitioned outputs, so it is only searched in its parents
+        files = []
+        for parent_ids_batch in gdu.split_ids_for_query(parent_ids):
+            query = gdu.query_parents_in(parent_ids_batch, name=tokens[-1], trashed=False)
+            files.extend(gdu.keep_files_with(self.googledrive_list(query), name=tokens[-1]))
+        if len(files) == 0:
+            return []
+        self.path_cache.set(tokens, files)
+        return files
+
+    def get_path_candidates_queries(self, tokens, depth, parent_ids):
+        """
+        Queries matching the folders that may be on the path to the last token, or None if parent_ids are too many.
+        The first name is only searched in parent_ids and the names in between only among folders,
+        so that common names match few unrelated items
+        """
+        first_clause = "(" + gdu.query_parents_in(parent_ids, name=tokens[depth], is_folder=True) + ")"
+        reserved_length = len(first_clause) + gdu.QUERY_EXTRA_CLAUSES_LENGTH
+        if reserved_length > gdu.MAX_QUERY_LENGTH // 2:
+            return None
+        clauses = [first_clause]
+        queries = []
+        folder_names = sorted(set(tokens[depth + 1:-1]))
+        for names_batch in gdu.split_names_for_query(folder_names, max_query_length=gdu.MAX_QUERY_LENGTH - reserved_length):
+            clauses.append("(" + gdu.query_names_in(names_batch, is_folder=True) + ")")
+            queries.append(clauses)
+            clauses = []
+        if clauses:
+            queries.append(clauses)
+        return ["(" + " or ".join(query_clauses) + ") and trashed=false" for query_clauses in queries]
+
+    def googledrive_list_candidates(self, query):
+        """
+        List the items matching query, or return None if they do not fit in MAX_PATH_RESOLUTION_PAGES pages
+        or the search could not cover every drive
+        """
+        candidates = []
+        pages = self.googledrive_list_pages(
+            query,
+            fields=gdu.PATH_RESOLUTION_FIELDS,
+            corpora=None if self.root_id == gdu.ROOT_ID else "allDrives"
+        )
+        try:
+            for index, response in enumerate(pages):
+                if response.get("incompleteSearch"):
+                    return None
+                candidates.extend(response.get("files", []))
+                if response.get("nextPageToken") and index + 1 >= gdu.MAX_PATH_RESOLUTION_PAGES:
+                    # Stop before paying for a page that would be thrown away
+                    return None
+        finally:
+            pages.close()
+        return candidates
+
+    def get_real_root_id(self):
+        if self.real_root_id is None:
+            root = self.googledrive_execute(
+                lambda: self.drive.files().get(fileId=self.root_id, fields=gdu.ID, supportsAllDrives=True),
+                "get"
+            )
+            self.real_root_id = gdu.get_id(root)
+        return self.real_root_id
+
+    def googledrive_is_shared_drive(self, drive_id):
+        attempts = 0
+        while attempts < self.max_attempts:
+            try:
+                self.execute_request(self.drive.drives().get(driveId=drive_id, fields=gdu.ID))
+                return True
+            except HttpError as err:
+                if err.resp.status == 404:
+                    return False
+                self.handle_googledrive_errors(err, "drive get", attempts)
+            attempts = attempts + 1
+            logger.info('googledrive_is_shared_drive:attempts={} on {}'.format(attempts, drive_id))
+        raise GoogleDriveSessionError("Max number of attempts reached in Google Drive drive get operation")
 
+    def resolve_level_by_level(self, tokens, depth, parent_ids):
+        files = []
+        for index in range(depth, len(tokens)):
+            token = tokens[index]
             query = gdu.query_parents_in(parent_ids, name_contains=token, trashed=False)
-            files = self.googledrive_list(query)
+            # Folders along the way are only needed to go one level down
+            is_last_token = index == len(tokens) - 1
+            files = self.googledrive_list(query, fields=gdu.LIST_FIELDS if is_last_token else gdu.PATH_LIST_FIELDS)
             files = gdu.keep_files_with(files, name_starting_with=token)
             files = gdu.keep_files_with(files, name=token)  # we only keep files / parent_ids for names = current token for the next loop
 
             if len(files) == 0:
-                return None
+                return []
+            self.path_cache.set(tokens[:index + 1], files)
             parent_ids = gdu.get_files_ids(files)
-        return files[0]
+        return files or []
+
+    def invalidate_path(self, path, membership_changed=True):
+        """
+        Forget what is known about path and its descendants, after it was modified.
+        membership_changed is False when items were only written, our uploads keeping the folder indexes current
+        """
+        self.path_cache.invalidate(path)
+        self.known_directories.invalidate(path)
+        if membership_changed:
+            with self.folder_indexes_lock:
+                self.folder_indexes.clear()
+                self.folder_listings.clear()
+        if self.drive_snapshot is not None:
+            self.drive_snapshot.mark_stale()
+        if self.read_ahead is not None:
+            self.read_ahead.clear()
 
-    def googledrive_download(self, item, stream):
+    def googledrive_download(self, item, stream, limit=None):
+        export_mime_type = None
         if gdu.is_file_google_doc(item):
-            document_type = gdu.get_google_doc_type(item)
-            data = self.drive.files().export_media(
+            export_mime_type = gdu.get_google_doc_mime_equivalence(
+                gdu.get_google_doc_type(item),
+                self.output_google_sheets_as_xlsx
+            )
+        key = None
+        if self.content_cache is not None:
+            key = ContentCache.get_key(item, export_mime_type=export_mime_type)
+        if key is None:
+            self.download_media(item, export_mime_type, stream, limit=limit)
+            return
+        cached_file = self.content_cache.open(key)
+        if cached_file is not None:
+            self.metrics.add("content_cache_hits")
+            with cached_file:
+                if limit is not None and limit > 0:
+                    stream.write(cached_file.read(limit))
+                else:
+                    shutil.copyfileobj(cached_file, stream)
+            return
+        self.metrics.add("content_cache_misses")
+        if limit is not None and limit > 0:
+            # Only whole files are cached
+            self.download_media(item, export_mime_type, stream, limit=limit)
+            return
+        try:
+            writer = self.content_cache.create_writer(key)
+        except (IOError, OSError) as err:
+            logger.warning("Content cache unavailable ({}), downloading without caching".format(err))
+            self.download_media(item, export_mime_type, stream)
+            return
+        try:
+            self.download_media(item, export_mime_type, TeeStreamWriter(stream, writer))
+        except Exception:
+            writer.discard()
+            raise
+        writer.commit()
+
+    def download_media(self, item, export_mime_type, stream, limit=None):
+        if export_mime_type is not None:
+            request = self.drive.files().export_media(
                 fileId=gdu.get_id(item),
-                mimeType=gdu.get_google_doc_mime_equivalence(
-                    document_type,
-                    self.output_google_sheets_as_xlsx
-                )
-            ).execute()
-            file_handle = BytesIO()
-            file_handle.write(data)
-            file_handle.seek(0)
-            shutil.copyfileobj(file_handle, stream)
+                mimeType=export_mime_type
+            )
         else:
             request = self.drive.files().get_media(fileId=gdu.get_id(item))
-            downloader = MediaIoBaseDownload(stream, request, chunksize=1024*1024)
-            done = False
+        chunk_size = gdu.DOWNLOAD_CHUNK_SIZE
+        if limit is not None and limit > 0:
+            # Range requests fetch only the first limit bytes, exports ignoring Range are cut short
+            chunk_count = -(-limit // chunk_size)
+            # The downloader asks for chunksize + 1 bytes, the end of its Range being inclusive
+            chunk_size = -(-limit // chunk_count) - 1
+            stream = LimitedStreamWriter(stream, limit)
+        counting_stream = CountingStreamWriter(stream)
+        if export_mime_type is not None:
+            is_done = stream.is_full if isinstance(stream, LimitedStreamWriter) else None
+            with self.metrics.operation("download"):
+                self.stream_export(request, counting_stream, is_done=is_done)
+            self.metrics.add("bytes_downloaded", counting_stream.written)
+            return
+        downloader = MediaIoBaseDownload(counting_stream, request, chunksize=chunk_size)
+        done = False
+        with self.metrics.operation("download"):
             while done is False:
-                status, done = downloader.next_chunk()
+                self.throttle()
+                with self.metrics.api_call(request.methodId + ".media"):
+                    # Bytes already written to the stream cannot be taken back, so chunks are retried in place,
+                    # which also covers read timeouts of the transport
+                    status, done = downloader.next_chunk(num_retries=self.max_attempts)
+                if isinstance(stream, LimitedStreamWriter) and stream.is_full():
+                    break
+        self.metrics.add("bytes_downloaded", counting_stream.written)
+
+    def stream_export(self, request, stream, is_done=None):
+        """
+        Write the export of request to the CountingStreamWriter stream as it arrives, until is_done() is true.
+        Exports ignore Range, so the chunked downloader would get the whole export in one response, held in memory by httplib2
+        """
+        attempts = 0
+        is_refreshed = False
+        while attempts < self.max_attempts:
+            headers = {}
+            # Refreshed here if expired, the requests of the Drive client being the only ones doing it otherwise
+            self.credentials.get_access_token(self.clients.create_http())
+            self.credentials.apply(headers)
+            self.throttle()
+            try:
+                with self.metrics.api_call(request.methodId + ".media"):
+                    response, content = self.clients.get_http().stream(request.uri, stream.write, headers=headers, is_done=is_done)
+            except (IOError, OSError, httplib2.HttpLib2Error, http.client.HTTPException) as err:
+                if stream.written > 0:
+                    # What was written to the DSS stream cannot be taken back
+                    raise GoogleDriveSessionError("Googledrive export error after {} bytes : {}".format(stream.written, err))
+                logger.info("Googledrive export error ({}), retrying".format(err))
+                sleep(self.retry_policy.get_delay(attempts))
+                attempts = attempts + 1
+                continue
+            if response.status == 200:
+                return
+            if response.status == 401 and not is_refreshed:
+                # The token was revoked or expired early
+                is_refreshed = True
+                try:
+                    self.credentials.refresh(self.clients.create_http())
+                except AccessTokenCredentialsError:
+                    raise GoogleDriveSessionError("Googledrive export error : the access token was refused and cannot be refreshed")
+                continue
+            self.handle_googledrive_errors(HttpError(response, content, uri=request.uri), "export", attempts)
+            attempts = attempts + 1
+            logger.info('stream_export:attempts={} on {}'.format(attempts, request.uri))
+        raise GoogleDriveSessionError("Max number of attempts reached in Google Drive export operation")
 
     def directory(self, item, root_path=None):
+        with self.metrics.operation("list_directory"):
+            return self.list_directory(item)
+
+    def list_directory(self, item):
+        if self.metadata_mirror is not None:
+            return self.metadata_mirror.get_children(gdu.get_id(item))
         query = gdu.query_parents_in([gdu.get_id(item)], trashed=False)
         files = self.googledrive_list(query)
         return files
 
-    def googledrive_list(self, query):
+    def list_tree(self, item):
+        """
+        Generate (relative_path, child) tuples for everything below the folder item, folders included.
+        Folders are listed when the entries before them have been consumed, so stopping early saves calls
+        """
+        with self.metrics.operation("list_tree"):
+            for entry in self.list_tree_from_source(item):
+                yield entry
+
+    def list_tree_from_source(self, item):
+        if self.metadata_mirror is not None:
+            return self.metadata_mirror.list_tree(gdu.get_id(item))
+        if self.get_drive_snapshot() is not None:
+            return self.drive_snapshot.list_tree(gdu.get_id(item))
+        return self.googledrive_list_tree([item])
+
+    def get_drive_snapshot(self):
+        """
+        Return the snapshot of the shared drive used as root, or None if flat sweeps are off or the root is not a shared drive
+        """
+        if self.drive_snapshot is not None and self.drive_snapshot.is_shared_drive():
+            return self.drive_snapshot
+        return None
+
+    def googledrive_list_tree(self, items):
+        """
+        List everything below the folder items, breadth-first, packing as many folders as possible in each query.
+        Returns (relative_path, child) tuples, folders included, paths being relative to the folder they are in
+        """
+        return gdu.walk_tree([gdu.get_id(item) for item in items], self.googledrive_list_children_of)
+
+    def googledrive_list_children_of(self, folder_ids):
+        """
+        Generate the children of all folder_ids as (parent_id, child) pairs
+        """
+        batches = self.split_level(folder_ids)
+        if len(batches) == 1:
+            # Children are passed on page by page, so that a caller that stops early saves the next pages
+            pages = self.googledrive_list_pages(gdu.query_parents_in(batches[0], trashed=False))
+            for response in pages:
+                for pair in self.pair_with_parents(batches[0], response.get('files', [])):
+                    yield pair
+            return
+        batches_children = self.map_parallel(
+            lambda parent_ids: self.googledrive_list(gdu.query_parents_in(parent_ids, trashed=False)),
+            batches
+        )
+        for parent_ids, children in zip(batches, batches_children):
+            for pair in self.pair_with_parents(parent_ids, children):
+                yield pair
+
+    def pair_with_parents(self, parent_ids, children):
+        """
+        Generate (parent_id, child) pairs for the children listed below parent_ids
+        """
+        batch_ids = set(parent_ids)
+        for child in children:
+            if len(parent_ids) == 1:
+                child_parent_ids = parent_ids  # also covers the "root" alias, which never appears in parents
+            else:
+                child_parent_ids = [parent_id for parent_id in child.get(gdu.PARENTS, []) if parent_id in batch_ids]
+            for parent_id in child_parent_ids:
+                yield parent_id, child
+
+    def find_first_file(self, item):
+        """
+        Return the (relative_path, child) of one file below the folder item, or None if there is none.
+        Each level costs one single-item query for files, and a listing of its subfolders if it has no file
+        """
+        with self.metrics.operation("find_first_file"):
+            return self.find_first_file_from_source(item)
+
+    def find_first_file_from_source(self, item):
+        if self.metadata_mirror is not None or self.get_drive_snapshot() is not None:
+            for child_path, child in self.list_tree(item):
+                if gdu.is_file(child):
+                    return child_path, child
+            return None
+        folder_paths = {gdu.get_id(item): ""}
+        level = [gdu.get_id(item)]
+        while level:
+            for parent_ids in gdu.split_ids_for_query(level):
+                first_file = self.find_first_child(parent_ids, gdu.query_parents_in(parent_ids, trashed=False, is_folder=False))
+                if first_file is not None:
+                    parent_id, child = first_file
+                    return folder_paths[parent_id] + '/' + gdu.get_name(child), child
+            next_level = []
+            for parent_ids in gdu.split_ids_for_query(level):
+                query = gdu.query_parents_in(parent_ids, trashed=False, is_folder=True)
+                folders = self.googledrive_list(query, fields=gdu.PATH_LIST_FIELDS)
+                for parent_id, folder in self.pair_with_parents(parent_ids, folders):
+                    folder_id = gdu.get_id(folder)
+                    if folder_id not in folder_paths:
+                        folder_paths[folder_id] = folder_paths[parent_id] + '/' + gdu.get_name(folder)
+                        next_level.append(folder_id)
+            level = next_level
+        return None
+
+    def find_first_child(self, parent_ids, query):
+        """
+        Return the first (parent_id, child) listed by query, or None
+        """
+        pages = self.googledrive_list_pages(query, page_size=1)
+        try:
+            # Drive may return an empty page with a next page token, the listing is only over once the token runs out
+            for response in pages:
+                for parent_id, child in self.pair_with_parents(parent_ids, response.get('files', [])):
+                    return parent_id, child
+        finally:
+            pages.close()
+        return None
+
+    def split_level(self, folder_ids):
+        """
+        Split folder_ids in query batches, using at least one batch per worker so that page fetches run side by side
+        """
+        batches = gdu.split_ids_for_query(folder_ids)
+        workers = min(self.max_parallel_requests, len(folder_ids))
+        if len(batches) >= workers:
+            return batches
+        batch_size = -(-len(folder_ids) // workers)
+        batches = []
+        for start in range(0, len(folder_ids), batch_size):
+            batches.extend(gdu.split_ids_for_query(folder_ids[start:start + batch_size]))
+        return batches
+
+    def googledrive_list(self, query, fields=gdu.LIST_FIELDS, page_size=gdu.MAX_PAGE_SIZE, drive_id=None):
+        """
+        List all the items matching query. fields is the field mask of the pages, to keep to what the caller uses
+        """
+        files = []
+        for response in self.googledrive_list_pages(query, fields=fields, page_size=page_size, drive_id=drive_id):
+            files.extend(response.get('files', []))
+        return files
+
+    def googledrive_list_pages(self, query, fields=gdu.LIST_FIELDS, page_size=gdu.MAX_PAGE_SIZE, drive_id=None, corpora=None):
+        """
+        Generate the responses of the successive pages of the listing of query, each page being fetched when needed
+        """
+        kwargs = {
+            'q': query,
+            'fields': fields,
+            'includeItemsFromAllDrives': True,
+            'supportsAllDrives': True
+        }
+        if page_size:
+            kwargs['pageSize'] = page_size
+        if drive_id:
+            kwargs['corpora'] = 'drive'
+            kwargs['driveId'] = drive_id
+        elif corpora:
+            kwargs['corpora'] = corpora
+        attempts = 0
+        initial_call = True
+        next_page_token = None
+        while initial_call or next_page_token:
+            if next_page_token:
+                kwargs['pageToken'] = next_page_token
+            try:
+                response = self.execute_request(self.drive.files().list(**kwargs))
+            except HttpError as err:
+                # Only the failed page is fetched again
+                self.handle_googledrive_errors(err, "list", attempts)
+                attempts = attempts + 1
+                logger.info('googledrive_list:attempts={} on {}'.format(attempts, query))
+                if attempts >= self.max_attempts:
+                    raise GoogleDriveSessionError("Max number of attempts reached in Google Drive directory list operation")
+                continue
+            initial_call = False
+            attempts = 0
+            self.metrics.add("pages")
+            next_page_token = response.get('nextPageToken')
+            yield response
+
+    def googledrive_execute(self, build_request, context=""):
+        """
+        Execute the request returned by build_request, retrying on transient errors
+        """
         attempts = 0
         while attempts < self.max_attempts:
             try:
-                files = []
-                kwargs = {
-                    'q': query,
-                    'fields': gdu.LIST_FIELDS,
-                    'includeItemsFromAllDrives': True,
-                    'supportsAllDrives': True
-                }
-                initial_call = True
-                next_page_token = None
-                while initial_call or next_page_token:
-                    initial_call = False
-                    if next_page_token:
-                        kwargs['pageToken'] = next_page_token
-                    response = self.drive.files().list(**kwargs).execute()
-                    files.extend(response.get('files', []))
-                    next_page_token = response.get('nextPageToken')
-                return files
+                return self.execute_request(build_request())
             except HttpError as err:
-                self.handle_googledrive_errors(err, "list")
+                self.handle_googledrive_errors(err, context, attempts)
             attempts = attempts + 1
-            logger.info('googledrive_list:attempts={} on {}'.format(attempts, query))
-        raise GoogleDriveSessionError("Max number of attempts reached in Google Drive directory list operation")
+            logger.info('googledrive_execute:attempts={} on {}'.format(attempts, context))
+        raise GoogleDriveSessionError("Max number of attempts reached in Google Drive {} operation".format(context))
 
-    def create_directory_from_path(self, path):
-        tokens = gdu.split_path(path)
+    def execute_request(self, request, num_retries=0):
+        self.throttle()
+        with self.metrics.api_call(request.methodId):
+            return request.execute(num_retries=num_retries)
 
-        parent_ids = [self.root_id]
-        current_path = ""
+    def create_directory_from_path(self, path):
+        """
+        Return the ID of the folder at path, creating the missing folders along the way in a single walk
+        """
+        tokens = [token for token in gdu.split_path(path) if token != '/']
+        directory_id = self.root_id
+        for index, token in enumerate(tokens):
+            current_tokens = tokens[:index + 1]
+            known_ids = self.known_directories.get(current_tokens)
+            if known_ids:
+                directory_id = known_ids[0]
+                continue
+            # Serialized per parent folder, so that concurrent writers do not create the same folder twice
+            with self.get_directory_creation_lock(directory_id):
+                known_ids = self.known_directories.get(current_tokens)
+                if known_ids:
+                    directory_id = known_ids[0]
+                    continue
+                query = gdu.query_parents_in([directory_id], name=token, trashed=False)
+                folders = [item for item in self.googledrive_list(query, fields=gdu.FOLDER_LIST_FIELDS) if gdu.is_directory(item)]
+                if folders:
+                    directory_id = gdu.get_id(folders[0])
+                else:
+                    directory_id = self.create_directory(token, [directory_id])
+                self.known_directories.set(current_tokens, [directory_id])
+        return directory_id
 
-        for token in tokens:
-            current_path = os.path.join(current_path, token)
-            item = self.get_item_from_path(current_path)
-            if item is None:
-                new_directory_id = self.create_directory(token, parent_ids)
-                parent_ids = [new_directory_id]
-            else:
-                new_directory_id = gdu.get_id(item)
-                parent_ids = [new_directory_id]
-        return new_directory_id
+    def get_directory_creation_lock(self, parent_id):
+        with self.directory_creation_locks_lock:
+            return self.directory_creation_locks.setdefault(parent_id, threading.Lock())
 
     def create_directory(self, name, parent_ids):
         file_metadata = {
@@ -176,19 +836,29 @@ class GoogleDriveSession():
 
         while attempts < self.max_attempts:
             try:
-                file = self.drive.files().create(
-                    body=body,
-                    media_body=media_body,
-                    fields=gdu.ID,
-                    supportsAllDrives=True
-                ).execute()
+                file = self.execute_request(
+                    self.drive.files().create(
+                        body=body,
+                        media_body=media_body,
+                        fields=self.get_written_item_fields(gdu.ID),
+                        supportsAllDrives=True
+                    ),
+                    num_retries=self.get_media_num_retries(media_body)
+                )
+                self.record_written_item(file)
                 return file
             except HttpError as err:
-                self.handle_googledrive_errors(err, "create")
+                self.handle_upload_errors(err, "create", attempts, media_body)
             attempts = attempts + 1
             logger.info('googledrive_create:attempts={} on {}'.format(attempts, body))
         raise GoogleDriveSessionError("Max number of attempts reached in Google Drive directory create operation")
 
+    def upload_to_path(self, full_path, file_handle):
+        base_path, file_name = os.path.split(full_path)
+        directory_id = self.create_directory_from_path(base_path)
+        self.googledrive_upload(file_name, file_handle, parent_id=directory_id)
+        self.invalidate_path(full_path, membership_changed=False)
+
     def googledrive_upload(self, filename, file_handle, parent_id=None):
         mime = MimeTypes()
         guessed_type = mime.guess_type(filename)[0]
@@ -204,40 +874,179 @@ class GoogleDriveSession():
         if guessed_type is None:
             guessed_type = gdu.BINARY_STREAM
 
-        media = MediaIoBaseUpload(
-            file_handle,
-            mimetype=guessed_type,
-            resumable=True
-        )
+        # Files up to the threshold are sent with their metadata in one multipart request,
+        # larger ones are streamed in resumable chunks starting with the bytes already read
+        prefix = read_prefix(file_handle, self.multipart_upload_threshold + 1)
+        if len(prefix) <= self.multipart_upload_threshold:
+            media = MediaIoBaseUpload(BytesIO(prefix), mimetype=guessed_type, resumable=False)
+        else:
+            media = StreamingMediaUpload(
+                file_handle,
+                mimetype=guessed_type,
+                chunksize=self.upload_chunk_size,
+                prefix=prefix
+            )
 
-        query = gdu.query_parents_in([parent_id], name=filename, trashed=False)
-        files = self.googledrive_list(query)
+        existing_file_id = self.find_file_in_folder(filename, parent_id)
 
-        if len(files) == 0:
-            self.googledrive_create(
-                body=file_metadata,
-                media_body=media,
-                parent_id=parent_id
-            )
+        with self.metrics.operation("upload"):
+            if existing_file_id is None:
+                file = self.googledrive_create(
+                    body=file_metadata,
+                    media_body=media,
+                    parent_id=parent_id
+                )
+            else:
+                file = self.googledrive_update(
+                    file_id=existing_file_id,
+                    body=file_metadata,
+                    media_body=media,
+                    parent_id=parent_id
+                )
+        self.metrics.add("bytes_uploaded", media.bytes_read if isinstance(media, StreamingMediaUpload) else len(prefix))
+        self.remember_file_in_folder(filename, gdu.get_id(file), parent_id)
+
+    def find_file_in_folder(self, name, folder_id):
+        """
+        Return the ID of the item called name in folder_id, or None. A folder receiving several uploads is listed once,
+        its name to ID index being then kept up to date by our own uploads
+        """
+        with self.folder_indexes_lock:
+            timestamp, names = self.folder_indexes.get(folder_id, (None, None))
+            is_fresh = timestamp is not None and time.time() - timestamp < gdu.FOLDER_INDEX_TTL
+            if is_fresh and names is not None:
+                return names.get(name)
+            is_listed = folder_id in self.folder_listings
+            if not is_fresh:
+                self.folder_indexes[folder_id] = (time.time(), None)
+            elif not is_listed:
+                # Our uploads to the folder until its listing is done, as the listing may miss them
+                self.folder_listings[folder_id] = {}
+        # Google Drive is called without holding the lock, so that uploads to other folders are not held up
+        if not is_fresh or is_listed:
+            # A single upload is cheaper to check with a targeted query than by listing a folder that may be big
+            query = gdu.query_parents_in([folder_id], name=name, trashed=False)
+            files = self.googledrive_list(query, fields=gdu.NAME_LIST_FIELDS)
+            return gdu.get_id(files[0]) if files else None
+        names = {}
+        try:
+            for file in self.googledrive_list(gdu.query_parents_in([folder_id], trashed=False), fields=gdu.NAME_LIST_FIELDS):
+                names.setdefault(gdu.get_name(file), gdu.get_id(file))
+        except Exception:
+            with self.folder_indexes_lock:
+                self.folder_listings.pop(folder_id, None)
+            raise
+        with self.folder_indexes_lock:
+            uploaded_names = self.folder_listings.pop(folder_id, None)
+            # Unless the folder changed in other ways while it was listed
+            if uploaded_names is not None:
+                names.update(uploaded_names)
+                self.folder_indexes[folder_id] = (time.time(), names)
+        return names.get(name)
+
+    def remember_file_in_folder(self, name, file_id, folder_id):
+        with self.folder_indexes_lock:
+            timestamp, names = self.folder_indexes.get(folder_id, (None, None))
+            if names is not None:
+                names[name] = file_id
+            if folder_id in self.folder_listings:
+                self.folder_listings[folder_id][name] = file_id
+
+    def get_indexed_item(self, path):
+        """
+        Return a partial item (ID and name) for path if the folder indexes already know it, without calling Google Drive
+        """
+        tokens = [token for token in gdu.split_path(path) if token != '/']
+        if not tokens:
+            return None
+        if len(tokens) == 1:
+            folder_ids = [self.root_id]
         else:
-            self.googledrive_update(
-                file_id=gdu.get_id(files[0]),
-                body=file_metadata,
-                media_body=media,
-                parent_id=parent_id
-            )
+            folder_ids = self.known_directories.get(tokens[:-1])
+        if not folder_ids:
+            return None
+        with self.folder_indexes_lock:
+            timestamp, names = self.folder_indexes.get(folder_ids[0], (None, None))
+            if names is None or time.time() - timestamp >= gdu.FOLDER_INDEX_TTL:
+                return None
+            file_id = names.get(tokens[-1])
+        if file_id is None:
+            return None
+        return {gdu.ID: file_id, gdu.NAME: tokens[-1]}
+
+    def move_file_in_folder_indexes(self, file_id, name, new_name, new_parent_id):
+        # Indexes are keyed by the folder IDs given by create_directory_from_path, aliases included
+        with self.folder_indexes_lock:
+            # Listings in progress may see the file under either name, so they are not kept
+            self.folder_listings.clear()
+            for folder_id, (timestamp, names) in self.folder_indexes.items():
+                if names is None:
+                    continue
+                is_in_folder = names.get(name) == file_id
+                if is_in_folder:
+                    del names[name]
+                if folder_id == new_parent_id or (is_in_folder and new_parent_id is None):
+                    names.setdefault(new_name, file_id)
+
+    def googledrive_move(self, item, new_name=None, new_parent_id=None):
+        """
+        Rename item and / or move it to the folder new_parent_id, in a single update call
+        """
+        if new_name is None and new_parent_id is None:
+            return item
+        item_id = gdu.get_id(item)
+        previous_parent_ids = item.get(gdu.PARENTS, [])
+        kwargs = {
+            'fileId': item_id,
+            'fields': self.get_written_item_fields(gdu.ID_PARENTS_FIELDS),
+            'supportsAllDrives': True
+        }
+        if new_name is not None:
+            kwargs['body'] = {gdu.NAME: new_name}
+        if new_parent_id is not None:
+            kwargs['addParents'] = new_parent_id
+            if previous_parent_ids:
+                kwargs['removeParents'] = ','.join(previous_parent_ids)
+        file = self.googledrive_execute(lambda: self.drive.files().update(**kwargs), "move")
+        self.record_written_item(file)
+        # Keep the name indexes of the folders current, as uploads rely on them
+        self.move_file_in_folder_indexes(item_id, gdu.get_name(item), new_name or gdu.get_name(item), new_parent_id)
+        return file
+
+    def get_written_item_fields(self, fields):
+        # The metadata mirror is updated with the items returned by our own writes, so it needs all their metadata
+        return gdu.ITEM_FIELDS if self.metadata_mirror is not None else fields
+
+    def record_written_item(self, item):
+        if self.metadata_mirror is not None:
+            self.metadata_mirror.record_item(item)
+
+    def get_media_num_retries(self, media_body):
+        # A streamed upload cannot be restarted from scratch, so its chunks are retried in place.
+        # Any other request, multipart uploads included, is only retried by the caller's attempts loop
+        return self.max_attempts if isinstance(media_body, StreamingMediaUpload) else 0
+
+    def handle_upload_errors(self, err, context, attempt, media_body):
+        if isinstance(media_body, StreamingMediaUpload):
+            # Its chunks were already retried in place and the stream cannot be read again from its start
+            raise GoogleDriveSessionError("Googledrive {} error : {}".format(context, self.retry_policy.get_reason(err) or err))
+        self.handle_googledrive_errors(err, context, attempt)
 
     def googledrive_update(self, file_id, body, media_body=None, parent_id=None):
         attempts = 0
         while attempts < self.max_attempts:
             try:
-                file = self.drive.files().update(
-                    fileId=file_id,
-                    body=body,
-                    media_body=media_body,
-                    fields=gdu.ID,
-                    supportsAllDrives=True
-                ).execute()
+                file = self.execute_request(
+                    self.drive.files().update(
+                        fileId=file_id,
+                        body=body,
+                        media_body=media_body,
+                        fields=self.get_written_item_fields(gdu.ID),
+                        supportsAllDrives=True
+                    ),
+                    num_retries=self.get_media_num_retries(media_body)
+                )
+                self.record_written_item(file)
                 logger.info("googledrive_update on {} successfull".format(body))
                 return file
             except HttpError as err:
@@ -251,36 +1060,90 @@ class GoogleDriveSession():
                     logger.info("googledrive_create:googledrive_create done")
                     return file
                 else:
-                    self.handle_googledrive_errors(err, "update")
+                    self.handle_upload_errors(err, "update", attempts, media_body)
             attempts = attempts + 1
             logger.info('googledrive_update:attempts={} on {}'.format(attempts, body))
         raise GoogleDriveSessionError("Max number of attempts reached in Google Drive directory update operation")
 
     def googledrive_delete(self, item, parent_id=None):
-        attempts = 0
-        while attempts < self.max_attempts:
-            try:
-                body_value = {'trashed': True}
+        return self.googledrive_trash([item])
+
+    def googledrive_trash(self, items):
+        """
+        Move items to the trash, in as few batched calls as possible. Return the number of trashed items
+        """
+        body_value = {'trashed': True}
+        responses = self.googledrive_batch(
+            [
                 self.drive.files().update(
-                        fileId=gdu.get_id(item),
-                        body=body_value,
-                        supportsAllDrives=True
-                    ).execute()
-                return 1
-            except HttpError as err:
-                logger.warn("HttpError={}".format(err))
-                if err.resp.status == 404:
-                    return 0
-                self.handle_googledrive_errors(err, "delete")
-            attempts = attempts + 1
-            logger.info('googledrive_delete:attempts={} on {}'.format(attempts, item))
-        raise GoogleDriveSessionError("Max number of attempts reached in Google Drive directory delete operation")
+                    fileId=gdu.get_id(item),
+                    body=body_value,
+                    fields=gdu.ID,
+                    supportsAllDrives=True
+                ) for item in items
+            ],
+            context="delete"
+        )
+        if self.metadata_mirror is not None:
+            self.metadata_mirror.record_removal([gdu.get_id(item) for item in items])
+        return len([response for response in responses if response is not None])
+
+    def googledrive_batch(self, requests, context=""):
+        """
+        Execute metadata requests grouped in multipart batch calls, retrying failed sub-requests individually.
+        Return the responses in the order of requests, None for the requests that failed with a 404
+        """
+        responses = [None] * len(requests)
+        pending = list(range(len(requests)))
+        attempts = 0
+        while pending:
+            if attempts >= self.max_attempts:
+                raise GoogleDriveSessionError("Max number of attempts reached in Google Drive batched {} operation".format(context))
+            errors = {}
+
+            def callback(request_id, response, exception):
+                index = int(request_id)
+                if exception is None:
+                    responses[index] = response
+                elif exception.resp.status != 404:
+                    errors[index] = exception
+
+            for start in range(0, len(pending), gdu.MAX_BATCH_SIZE):
+                batch = self.drive.new_batch_http_request(callback=callback)
+                group = pending[start:start + gdu.MAX_BATCH_SIZE]
+                for index in group:
+                    batch.add(requests[index], request_id=str(index))
+                try:
+                    self.throttle(len(group))
+                    with self.metrics.api_call("batch"):
+                        batch.execute()
+                except HttpError as err:
+                    for index in group:
+                        errors[index] = err
+            pending = sorted(errors)
+            if pending:
+                non_retryable_errors = [errors[index] for index in pending if not self.is_retryable_error(errors[index])]
+                self.handle_googledrive_errors((non_retryable_errors or [errors[pending[0]]])[0], context, attempts)
+                attempts = attempts + 1
+                logger.info('googledrive_batch:attempts={} on {} {} requests'.format(attempts, len(pending), context))
+        return responses
+
+    def is_retryable_error(self, err):
+        return self.retry_policy.is_retryable(err)
+
+    def throttle(self, permits=1):
+        if self.rate_limiter is not None:
+            self.metrics.add("throttle_seconds", self.rate_limiter.acquire(permits))
 
-    def handle_googledrive_errors(self, err, context=""):
-        if err.resp.status in [403, 500, 503]:
-            sleep(5 + randrange(5))
+    def handle_googledrive_errors(self, err, context="", attempt=0):
+        if self.is_retryable_error(err):
+            delay = self.retry_policy.get_delay(attempt, err)
+            logger.info("Googledrive {} error {} ({}), retrying in {:.1f}s".format(
+                context, err.resp.status, self.retry_policy.get_reason(err), delay
+            ))
+            self.metrics.add("retries")
+            self.metrics.add("backoff_seconds", delay)
+            sleep(delay)
         else:
-            reason = ""
-            if err.resp.get('content-type', '').startswith('application/json'):
-                reason = json.loads(err.content).get('error').get('errors')[0].get('reason')
+            reason = self.retry_policy.get_reason(err)
             raise GoogleDriveSessionError("Googledrive {} error : {}".format(context, reason))
@@ -0,0 +1,90 @@
+from googleapiclient.http import MediaUpload
+
+
+class StreamingMediaUploadError(ValueError):
+    pass
+
+
+class StreamingMediaUpload(MediaUpload):
+    """
+    Resumable media upload fed chunk by chunk from a stream that cannot be rewound nor measured
+
+    Only the bytes not yet acknowledged by Google Drive and the next chunk are kept, so memory use is bounded by twice the chunk size
+
+    :param stream: file-like object to read the content from
+    :param mimetype: mime type of the uploaded content
+    :param chunksize: size of each uploaded chunk, must be a multiple of 256 KB
+    :param prefix: bytes already read from stream, uploaded first
+    """
+    def __init__(self, stream, mimetype, chunksize, prefix=b""):
+        super(StreamingMediaUpload, self).__init__()
+        self._stream = stream
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray(prefix)
+        self._buffer_start = 0
+        self._next_begin = 0
+        self._size = None
+        self.bytes_read = len(prefix)
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        # googleapiclient reads the size before asking for each chunk. Reading the next chunk and one more byte ahead
+        # lets the last chunk carry the total: when the stream ends on a chunk boundary, the chunk following it would
+        # otherwise be empty and sent with an invalid Content-Range
+        if self._size is None:
+            self.fill(self._next_begin + self._chunksize + 1)
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        if begin < self._buffer_start:
+            raise StreamingMediaUploadError(
+                "Cannot restart the upload at byte {}, bytes before {} were already sent".format(begin, self._buffer_start)
+            )
+        # Everything before begin has been acknowledged by Google Drive and can be released
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+        self.fill(begin + length)
+        data = bytes(self._buffer[:length])
+        self._next_begin = begin + len(data)
+        return data
+
+    def fill(self, end):
+        """
+        Read the stream until the buffer reaches the offset end, or the stream ends
+        """
+        while self._size is None and self._buffer_start + len(self._buffer) < end:
+            data = self._stream.read(end - self._buffer_start - len(self._buffer))
+            if not data:
+                self._size = self._buffer_start + len(self._buffer)
+                break
+            self._buffer.extend(data)
+            self.bytes_read = self.bytes_read + len(data)
+
+    def to_json(self):
+        # Serializing would lose the bytes already read from the stream, so the upload could not be resumed from it
+        raise StreamingMediaUploadError("A streaming upload cannot be serialized, as its stream cannot be read again")
+
+
+def read_prefix(stream, size):
+    """
+    Read up to size bytes from stream, fewer only if it ends before
+    """
+    prefix = bytearray()
+    while len(prefix) < size:
+        data = stream.read(size - len(prefix))
+        if not data:
+            break
+        prefix.extend(data)
+    return bytes(prefix)
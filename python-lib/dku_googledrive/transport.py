@@ -0,0 +1,176 @@
+import http.client
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import httplib2
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+
+
+class TimeoutHttp(httplib2.Http):
+    """
+    httplib2.Http with distinct timeouts to open a connection and to wait for data on it
+
+    :param connect_timeout: seconds allowed to open a connection
+    :param read_timeout: seconds allowed between two reads of a response
+    """
+    def __init__(self, connect_timeout, read_timeout):
+        httplib2.Http.__init__(self, timeout=connect_timeout)
+        self.read_timeout = read_timeout
+        self.connection_types = {
+            "http": with_read_timeout(httplib2.HTTPConnectionWithTimeout, read_timeout),
+            "https": with_read_timeout(httplib2.HTTPSConnectionWithTimeout, read_timeout)
+        }
+        # 308 responses of resumable uploads are not redirects
+        self.redirect_codes = self.redirect_codes - {308}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        if connection_type is None:
+            connection_type = self.connection_types.get(urlsplit(uri).scheme.lower())
+        return httplib2.Http.request(self, uri, method=method, body=body, headers=headers, redirections=redirections, connection_type=connection_type)
+
+    def stream(self, uri, write, headers=None, is_done=None, chunk_size=gdu.DOWNLOAD_CHUNK_SIZE):
+        """
+        GET uri over the kept-alive connections, passing the body to write chunk by chunk instead of holding it in memory,
+        and stopping early once is_done() is true. Return the httplib2.Response and the body if the status is not 200
+        """
+        scheme, authority, request_uri, defrag_uri = httplib2.urlnorm(uri)
+        connection_key = scheme + ":" + authority
+        connection = self.connections.pop(connection_key, None)
+        is_reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self.create_connection(scheme, authority)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.request("GET", request_uri, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, socket.error):
+                connection.close()
+                connection = None
+                if not is_reused:
+                    raise
+                # The server closed the idle connection meanwhile
+                is_reused = False
+        try:
+            if response.status != 200:
+                content = response.read()
+                self.connections[connection_key] = connection
+                return httplib2.Response(response), content
+            while is_done is None or not is_done():
+                data = response.read(chunk_size)
+                if not data:
+                    break
+                write(data)
+        except Exception:
+            connection.close()
+            raise
+        if response.isclosed():
+            self.connections[connection_key] = connection
+        else:
+            # Stopped before the end of the body, the connection cannot carry another request
+            connection.close()
+        return httplib2.Response(response), None
+
+    def create_connection(self, scheme, authority):
+        connection_type = self.connection_types[scheme]
+        if scheme == "https":
+            return connection_type(
+                authority,
+                timeout=self.timeout,
+                proxy_info=self.proxy_info,
+                ca_certs=self.ca_certs,
+                disable_ssl_certificate_validation=self.disable_ssl_certificate_validation,
+                tls_maximum_version=self.tls_maximum_version,
+                tls_minimum_version=self.tls_minimum_version
+            )
+        return connection_type(authority, timeout=self.timeout, proxy_info=self.proxy_info)
+
+
+def with_read_timeout(connection_class, read_timeout):
+    """
+    Subclass of the httplib2 connection_class switching to read_timeout once connected, reconnections included
+    """
+    class ReadTimeoutConnection(connection_class):
+        def connect(self):
+            connection_class.connect(self)
+            self.sock.settimeout(read_timeout)
+    return ReadTimeoutConnection
+
+
+class PooledHttp():
+    """
+    Thread-safe stand-in for httplib2.Http. Each request borrows an idle TimeoutHttp, whose TLS connections are kept alive
+    for the next requests, so that concurrent calls run over warm connections instead of one handshake per thread.
+    JSON responses are asked gzip encoded
+
+    :param connect_timeout: seconds allowed to open a connection
+    :param read_timeout: seconds allowed between two reads of a response
+    :param max_idle: number of idle clients kept, the others being closed when released
+    """
+    def __init__(self, connect_timeout=gdu.DEFAULT_CONNECT_TIMEOUT, read_timeout=gdu.DEFAULT_READ_TIMEOUT, max_idle=gdu.MAX_IDLE_HTTP_CLIENTS):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        headers = self.get_headers(headers)
+        client = self.acquire()
+        try:
+            return client.request(uri, method=method, body=body, headers=headers, redirections=redirections, connection_type=connection_type)
+        finally:
+            self.release(client)
+
+    def stream(self, uri, write, headers=None, is_done=None, chunk_size=gdu.DOWNLOAD_CHUNK_SIZE):
+        """
+        GET uri like TimeoutHttp.stream, the body being passed to write as it arrives
+        """
+        # The raw body is asked, so that its chunks can be written as they are
+        headers = dict(self.get_headers(headers), **{"accept-encoding": "identity"})
+        client = self.acquire()
+        try:
+            return client.stream(uri, write, headers=headers, is_done=is_done, chunk_size=chunk_size)
+        finally:
+            self.release(client)
+
+    @staticmethod
+    def get_headers(headers):
+        headers = dict(headers or {})
+        names = dict((name.lower(), name) for name in headers)
+        if "range" in names:
+            # Ranges of media downloads apply to the raw content
+            return headers
+        # Google APIs only compress responses for user agents mentioning gzip
+        user_agent = headers.pop(names.get("user-agent"), None) or gdu.USER_AGENT
+        if "gzip" not in user_agent:
+            user_agent = user_agent + " (gzip)"
+        headers["user-agent"] = user_agent
+        if "accept-encoding" not in names:
+            headers["accept-encoding"] = "gzip, deflate"
+        return headers
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                # The most recently used client has the most chances to hold live connections
+                return self.idle.pop()
+        return TimeoutHttp(self.connect_timeout, self.read_timeout)
+
+    def release(self, client):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(client)
+                return
+        client.close()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for client in idle:
+            client.close()
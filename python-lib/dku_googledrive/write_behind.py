@@ -0,0 +1,159 @@
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+from dku_googledrive.path_cache import PathCache
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindError(ValueError):
+    pass
+
+
+class WriteBehind():
+    """
+    Uploads written files in the background: write spools the content and returns, the uploads running on a bounded pool.
+    Failed uploads are raised by the next write and by close
+
+    :param session: the GoogleDriveSession used to upload
+    :param max_uploads: number of uploads in flight
+    :param max_spooled_bytes: bound on the total size of the files spooled and not uploaded yet, the file being spooled included.
+        A file bigger than this is uploaded before write returns
+    :param max_memory_per_file: size above which a spooled file is moved from memory to a local temporary file
+    """
+    COPY_CHUNK_SIZE = gdu.MEGABYTE
+
+    def __init__(self, session, max_uploads, max_spooled_bytes, max_memory_per_file=gdu.WRITE_BEHIND_MAX_MEMORY_PER_FILE):
+        self.session = session
+        self.max_spooled_bytes = max_spooled_bytes
+        self.max_memory_per_file = max_memory_per_file
+        self.executor = ThreadPoolExecutor(max_workers=max_uploads)
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.spooled_bytes = 0
+        self.errors = []
+
+    def write(self, full_path, stream):
+        self.raise_errors()
+        path = PathCache.normalize(full_path)
+        # A new version of a file is uploaded after the previous one, or both could be created
+        self.flush(path)
+        spool = tempfile.SpooledTemporaryFile(max_size=self.max_memory_per_file)
+        size = 0
+        try:
+            while True:
+                data = stream.read(self.COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                # Reserved as the file is copied, so that the spool never holds more than max_spooled_bytes
+                if not self.reserve(len(data), size):
+                    spool.write(data)
+                    spool.seek(0)
+                    logger.info("{} is bigger than the upload buffer, uploading it before returning".format(full_path))
+                    self.session.upload_to_path(full_path, ChainedStream(spool, stream))
+                    spool.close()
+                    self.release(size)
+                    return
+                spool.write(data)
+                size = size + len(data)
+            spool.seek(0)
+            with self.condition:
+                future = self.executor.submit(self.upload, full_path, spool, size)
+                self.pending[path] = future
+        except Exception:
+            spool.close()
+            self.release(size)
+            raise
+        future.add_done_callback(lambda done_future: self.forget(path, done_future))
+
+    def reserve(self, length, reserved):
+        """
+        Wait until length more bytes fit in the spool, reserved bytes being already spooled by the caller.
+        Return False if they never will, the caller's file alone being bigger than the spool
+        """
+        with self.condition:
+            if self.spooled_bytes + length > self.max_spooled_bytes:
+                with self.session.metrics.operation("write_behind_wait"):
+                    while self.spooled_bytes + length > self.max_spooled_bytes:
+                        if self.spooled_bytes - reserved == 0:
+                            return False
+                        self.condition.wait()
+            self.spooled_bytes = self.spooled_bytes + length
+            return True
+
+    def release(self, length):
+        with self.condition:
+            self.spooled_bytes = self.spooled_bytes - length
+            self.condition.notify_all()
+
+    def upload(self, full_path, spool, size):
+        try:
+            self.session.upload_to_path(full_path, spool)
+        except Exception as err:
+            logger.error("Background upload of {} failed ({})".format(full_path, err))
+            with self.condition:
+                self.errors.append((full_path, err))
+            raise
+        finally:
+            spool.close()
+            self.release(size)
+
+    def forget(self, path, future):
+        with self.condition:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+
+    def flush(self, full_path="/"):
+        """
+        Wait for the pending uploads of full_path, of the files below it and of the folders above it
+        """
+        path = PathCache.normalize(full_path)
+        with self.condition:
+            futures = [future for pending_path, future in self.pending.items() if paths_overlap(path, pending_path)]
+        if futures:
+            with self.session.metrics.operation("write_behind_flush"):
+                wait(futures)
+
+    def raise_errors(self):
+        with self.condition:
+            errors = list(self.errors)
+        if errors:
+            full_path, err = errors[0]
+            raise WriteBehindError("{} background upload(s) failed, first one of {}: {}".format(len(errors), full_path, err))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.raise_errors()
+
+
+class ChainedStream():
+    """
+    Read first from one stream, then from the other
+
+    :param first: the stream read until it ends
+    :param second: the stream read after
+    """
+    def __init__(self, first, second):
+        self.streams = [first, second]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = b"".join(stream.read() for stream in self.streams)
+            self.streams = []
+            return data
+        while self.streams:
+            data = self.streams[0].read(size)
+            if data:
+                return data
+            self.streams.pop(0)
+        return b""
+
+
+def paths_overlap(path, other_path):
+    if path == other_path:
+        return True
+    return other_path.startswith(path.rstrip("/") + "/") or path.startswith(other_path.rstrip("/") + "/")
@@ -0,0 +1,777 @@
+"""
+In-process fake of the subset of the Google Drive v3 REST API used by the plugin.
+
+Supports files.list (q, fields, pageSize, pageToken, corpora/driveId), files.get (metadata and
+alt=media with Range), files.export, files.create / files.update (metadata, multipart and resumable
+uploads), files.delete, drives.get, changes.getStartPageToken / changes.list and the multipart batch endpoint.
+Latency and 403 / 429 / 503 errors can be injected, and every call is counted. The /_fake/stats,
+/_fake/reset and /_fake/configure endpoints expose the counters and settings to clients running
+in another process.
+"""
+import copy
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from email.parser import BytesParser
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FOLDER = "application/vnd.google-apps.folder"
+GOOGLE_APPS = "application/vnd.google-apps."
+MY_DRIVE_ROOT_ID = "my-drive-root"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+ERROR_REASONS = {
+    403: "userRateLimitExceeded",
+    429: "rateLimitExceeded",
+    503: "backendError"
+}
+
+
+class QueryError(ValueError):
+    pass
+
+
+class QueryParser(object):
+    """
+    Parses the Drive search query language into a predicate on file resources
+    """
+    TOKEN_REGEX = re.compile(r"\s*(?:(?P<string>'(?:[^'\\]|\\.)*')|(?P<op>!=|<=|>=|=|<|>|\(|\))|(?P<word>[A-Za-z_][A-Za-z0-9_.]*))")
+
+    def __init__(self, query):
+        self.tokens = self.tokenize(query)
+        self.position = 0
+
+    def tokenize(self, query):
+        tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = self.TOKEN_REGEX.match(query, position)
+            if match is None or match.end() == position:
+                raise QueryError("Invalid query near: {}".format(query[position:]))
+            position = match.end()
+            if match.group("string") is not None:
+                raw = match.group("string")[1:-1]
+                tokens.append(("string", re.sub(r"\\(.)", r"\1", raw)))
+            elif match.group("op") is not None:
+                tokens.append(("op", match.group("op")))
+            else:
+                tokens.append(("word", match.group("word")))
+            while position < len(query) and query[position].isspace():
+                position += 1
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        predicate = self.parse_or()
+        if self.position != len(self.tokens):
+            raise QueryError("Unexpected token {}".format(self.peek()))
+        return predicate
+
+    def parse_or(self):
+        predicates = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.next()
+            predicates.append(self.parse_and())
+        return lambda item: any(predicate(item) for predicate in predicates)
+
+    def parse_and(self):
+        predicates = [self.parse_not()]
+        while self.peek() == ("word", "and"):
+            self.next()
+            predicates.append(self.parse_not())
+        return lambda item: all(predicate(item) for predicate in predicates)
+
+    def parse_not(self):
+        if self.peek() == ("word", "not"):
+            self.next()
+            predicate = self.parse_not()
+            return lambda item: not predicate(item)
+        if self.peek() == ("op", "("):
+            self.next()
+            predicate = self.parse_or()
+            if self.next() != ("op", ")"):
+                raise QueryError("Missing closing parenthesis")
+            return predicate
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        kind, value = self.next()
+        if kind == "string":
+            if self.next() != ("word", "in"):
+                raise QueryError("Expected 'in' after {}".format(value))
+            kind, field = self.next()
+            if field != "parents":
+                raise QueryError("Unsupported collection {}".format(field))
+            return lambda item: value in item.get("parents", []) or (value == "root" and MY_DRIVE_ROOT_ID in item.get("parents", []))
+        if kind != "word":
+            raise QueryError("Unexpected token {}".format(value))
+        field = value
+        operator_kind, operator = self.next()
+        if operator not in ("=", "!=", "contains", "<", ">", "<=", ">="):
+            raise QueryError("Unsupported operator {}".format(operator))
+        value_kind, operand = self.next()
+        if value_kind == "word" and operand in ("true", "false"):
+            operand = operand == "true"
+        elif value_kind != "string":
+            raise QueryError("Unexpected operand {}".format(operand))
+
+        def predicate(item):
+            current = item.get(field, False if field == "trashed" else None)
+            if operator == "=":
+                return current == operand
+            if operator == "!=":
+                return current != operand
+            if operator == "contains":
+                return current is not None and operand in current
+            if current is None:
+                return False
+            return {
+                "<": current < operand,
+                ">": current > operand,
+                "<=": current <= operand,
+                ">=": current >= operand
+            }[operator]
+        return predicate
+
+
+class FakeDrive(object):
+    """
+    State of the fake Drive: file resources, their content and the change log
+
+    :param latency: seconds to wait before answering each HTTP request
+    :param error_rate: probability for a request to fail with one of error_statuses
+    :param error_statuses: statuses used for injected errors
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, error_statuses=(403, 429, 503), seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.files = {}
+        self.contents = {}
+        self.changes = []
+        self.upload_sessions = {}
+        self.next_id = 0
+        self.clock = datetime(2024, 1, 1)
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self.files[MY_DRIVE_ROOT_ID] = {
+            "id": MY_DRIVE_ROOT_ID,
+            "name": "My Drive",
+            "mimeType": FOLDER,
+            "parents": [],
+            "modifiedTime": self.timestamp(),
+            "createdTime": self.timestamp(),
+            "trashed": False
+        }
+
+    def timestamp(self):
+        self.clock += timedelta(seconds=1)
+        return self.clock.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def new_id(self, prefix="id"):
+        with self.lock:
+            self.next_id += 1
+            return "{}{:08d}".format(prefix, self.next_id)
+
+    def resolve_id(self, file_id):
+        return MY_DRIVE_ROOT_ID if file_id == "root" else file_id
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.connections = 0
+
+    def add_shared_drive(self, name):
+        drive_id = self.new_id("drive")
+        with self.lock:
+            self.files[drive_id] = {
+                "id": drive_id,
+                "name": name,
+                "mimeType": FOLDER,
+                "parents": [],
+                "driveId": drive_id,
+                "modifiedTime": self.timestamp(),
+                "createdTime": self.timestamp(),
+                "trashed": False
+            }
+        return drive_id
+
+    def is_shared_drive(self, drive_id):
+        return drive_id in self.files and self.files[drive_id].get("driveId") == drive_id
+
+    def add_folder(self, name, parent_id):
+        return self.add_item(name, parent_id, FOLDER)
+
+    def add_file(self, name, parent_id, content=b"", mime_type="text/csv"):
+        return self.add_item(name, parent_id, mime_type, content=content)
+
+    def add_item(self, name, parent_id, mime_type, content=None):
+        parent_id = self.resolve_id(parent_id)
+        with self.lock:
+            item = {
+                "id": self.new_id(),
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent_id],
+                "modifiedTime": self.timestamp(),
+                "createdTime": self.timestamp(),
+                "trashed": False
+            }
+            drive_id = self.files.get(parent_id, {}).get("driveId")
+            if drive_id:
+                item["driveId"] = drive_id
+            self.files[item["id"]] = item
+            if content is not None:
+                self.set_content(item, content)
+            self.record_change(item)
+            return item["id"]
+
+    def set_content(self, item, content):
+        self.contents[item["id"]] = content
+        if not item["mimeType"].startswith(GOOGLE_APPS):
+            item["size"] = str(len(content))
+            item["md5Checksum"] = hashlib.md5(content).hexdigest()
+        item["modifiedTime"] = self.timestamp()
+
+    def record_change(self, item, removed=False):
+        self.changes.append({
+            "kind": "drive#change",
+            "changeType": "file",
+            "fileId": item["id"],
+            "removed": removed,
+            "file": None if removed else copy.deepcopy(item)
+        })
+
+    def is_trashed(self, item):
+        seen = set()
+        while item is not None and item["id"] not in seen:
+            if item.get("trashed"):
+                return True
+            seen.add(item["id"])
+            parents = item.get("parents") or []
+            item = self.files.get(parents[0]) if parents else None
+        return False
+
+    # HTTP level helpers
+
+    def maybe_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.random.choice(self.error_statuses)
+        return None
+
+
+def project(item, fields):
+    """
+    Apply a files(...) field mask to a file resource
+    """
+    if not fields:
+        return item
+    match = re.search(r"files\(([^)]*)\)", fields)
+    if match:
+        wanted = [field.strip() for field in match.group(1).split(",")]
+    else:
+        wanted = [field.strip() for field in fields.split(",")]
+    if "*" in wanted:
+        return item
+    return dict((key, value) for key, value in item.items() if key in wanted)
+
+
+def public_view(item):
+    return dict((key, value) for key, value in item.items() if key != "trashed" or value)
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    drive = None
+    discovery_document = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        if self.drive is not None:
+            with self.drive.lock:
+                self.drive.connections += 1
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def read_body(self):
+        length = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return body
+
+    def dispatch(self, method):
+        body = self.read_body()
+        drive = self.drive
+        parsed = urlparse(self.path)
+        if drive.latency and not parsed.path.startswith("/_fake/"):
+            time.sleep(drive.latency)
+        with drive.lock:
+            drive.bytes_received += len(body)
+        if parsed.path == "/discovery":
+            self.send(200, self.discovery_document)
+            return
+        if parsed.path.startswith("/_fake/"):
+            self.send(200, control(drive, parsed.path, body))
+            return
+        status = drive.maybe_fail()
+        if status is not None and parsed.path != "/batch/drive/v3":
+            with drive.lock:
+                drive.calls["error.{}".format(status)] += 1
+            self.send_error_status(status)
+            return
+        path = self.path
+        override = self.headers.get("x-http-method-override")
+        if override:
+            # googleapiclient turns GET requests with very long URLs into form-encoded POSTs
+            method = override
+            path = "{}?{}".format(parsed.path, body.decode("utf-8"))
+            body = b""
+        status, headers, payload = route(drive, method, path, dict(self.headers.items()), body)
+        self.send(status, payload, headers)
+
+    def send_error_status(self, status):
+        headers = {"Retry-After": "0"} if status == 429 else {}
+        self.send(status, error_payload(status, ERROR_REASONS.get(status, "error")), headers)
+
+    def send(self, status, payload, headers=None):
+        headers = headers or {}
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json; charset=UTF-8")
+            # Like Google APIs, only compress for clients asking for it in both headers
+            if "gzip" in self.headers.get("accept-encoding", "") and "gzip" in self.headers.get("user-agent", ""):
+                payload = gzip.compress(payload)
+                headers["Content-Encoding"] = "gzip"
+        elif payload is None:
+            payload = b""
+        with self.drive.lock:
+            self.drive.bytes_sent += len(payload)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def control(drive, path, body):
+    """
+    Out of band endpoints letting a client in another process read the counters and tune the fake
+    """
+    with drive.lock:
+        if path == "/_fake/reset":
+            drive.reset_counters()
+        elif path == "/_fake/configure":
+            settings = json.loads(body or b"{}")
+            drive.latency = settings.get("latency", drive.latency)
+            drive.error_rate = settings.get("error_rate", drive.error_rate)
+            drive.error_statuses = tuple(settings.get("error_statuses", drive.error_statuses))
+        return {
+            "calls": dict(drive.calls),
+            "bytes_sent": drive.bytes_sent,
+            "bytes_received": drive.bytes_received,
+            "connections": drive.connections
+        }
+
+
+def error_payload(status, reason, message=""):
+    return {
+        "error": {
+            "errors": [{"domain": "usageLimits" if status in (403, 429) else "global", "reason": reason, "message": message or reason}],
+            "code": status,
+            "message": message or reason
+        }
+    }
+
+
+def route(drive, method, path, headers, body):
+    """
+    Serve one (possibly batched) API request. Returns (status, headers, payload)
+    """
+    parsed = urlparse(path)
+    params = dict((key, values[0]) for key, values in parse_qs(parsed.query).items())
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    try:
+        if segments[:3] == ["batch", "drive", "v3"]:
+            return serve_batch(drive, headers, body)
+        if segments[:3] == ["upload", "drive", "v3"]:
+            file_id = segments[4] if len(segments) > 4 else None
+            return serve_upload(drive, method, file_id, params, headers, body)
+        if segments[:2] == ["upload", "session"]:
+            return serve_resumable_chunk(drive, segments[2], headers, body)
+        if segments[:2] != ["drive", "v3"]:
+            return 404, {}, error_payload(404, "notFound")
+        resource = segments[2:]
+        if resource == ["files"] and method == "GET":
+            return serve_list(drive, params)
+        if resource == ["files"] and method == "POST":
+            with drive.lock:
+                drive.calls["files.create"] += 1
+            return serve_create(drive, params, json.loads(body or b"{}"), None)
+        if resource[:1] == ["files"] and len(resource) == 2:
+            file_id = drive.resolve_id(resource[1])
+            if method == "GET":
+                return serve_get(drive, file_id, params, headers)
+            if method == "PATCH":
+                with drive.lock:
+                    drive.calls["files.update"] += 1
+                return serve_update(drive, file_id, params, json.loads(body or b"{}"), None)
+            if method == "DELETE":
+                return serve_delete(drive, file_id)
+        if resource[:1] == ["files"] and len(resource) == 3 and resource[2] == "export":
+            return serve_export(drive, drive.resolve_id(resource[1]), params, headers)
+        if resource[:1] == ["drives"] and len(resource) == 2 and method == "GET":
+            return serve_get_drive(drive, resource[1])
+        if resource == ["about"]:
+            with drive.lock:
+                drive.calls["about.get"] += 1
+            return 200, {}, {"user": {"permissionId": "fake-permission-id", "displayName": "Fake User"}}
+        if resource == ["changes", "startPageToken"]:
+            with drive.lock:
+                drive.calls["changes.getStartPageToken"] += 1
+                return 200, {}, {"startPageToken": str(len(drive.changes))}
+        if resource == ["changes"]:
+            return serve_changes(drive, params)
+    except QueryError as error:
+        return 400, {}, error_payload(400, "invalid", str(error))
+    return 404, {}, error_payload(404, "notFound")
+
+
+def serve_list(drive, params):
+    with drive.lock:
+        drive.calls["files.list"] += 1
+        query = params.get("q")
+        predicate = QueryParser(query).parse() if query else (lambda item: True)
+        items = [item for item in drive.files.values() if item["id"] != MY_DRIVE_ROOT_ID]
+        if params.get("corpora") == "drive" and not drive.is_shared_drive(params.get("driveId")):
+            return 404, {}, error_payload(404, "notFound", "Shared drive not found: {}".format(params.get("driveId")))
+        if params.get("corpora") == "drive":
+            items = [item for item in items if item.get("driveId") == params.get("driveId") and item["id"] != params.get("driveId")]
+        items = [item for item in items if predicate(item)]
+        if not (query and "trashed" in query):
+            items = [item for item in items if not item.get("trashed")]
+        page_size = min(int(params.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = int(params.get("pageToken", 0))
+        page = items[offset:offset + page_size]
+        response = {"files": [project(public_view(item), params.get("fields")) for item in page]}
+        if offset + page_size < len(items):
+            response["nextPageToken"] = str(offset + page_size)
+        return 200, {}, response
+
+
+def serve_get_drive(drive, drive_id):
+    with drive.lock:
+        drive.calls["drives.get"] += 1
+        if not drive.is_shared_drive(drive_id):
+            return 404, {}, error_payload(404, "notFound", "Shared drive not found: {}".format(drive_id))
+        return 200, {}, {"id": drive_id, "name": drive.files[drive_id]["name"]}
+
+
+def serve_get(drive, file_id, params, headers):
+    with drive.lock:
+        item = drive.files.get(file_id)
+        if item is None:
+            drive.calls["files.get"] += 1
+            return 404, {}, error_payload(404, "notFound")
+        if params.get("alt") != "media":
+            drive.calls["files.get"] += 1
+            return 200, {}, project(public_view(item), params.get("fields"))
+        drive.calls["files.get_media"] += 1
+        content = drive.contents.get(file_id, b"")
+    return serve_content(content, headers)
+
+
+def serve_content(content, headers):
+    range_header = headers.get("range") or headers.get("Range")
+    if not range_header:
+        return 200, {"Content-Type": "application/octet-stream"}, content
+    start, end = range_header.split("=", 1)[1].split("-")
+    start = int(start)
+    end = min(int(end) if end else len(content) - 1, len(content) - 1)
+    if start >= len(content):
+        return 416, {"Content-Range": "bytes */{}".format(len(content))}, b""
+    return 206, {
+        "Content-Type": "application/octet-stream",
+        "Content-Range": "bytes {}-{}/{}".format(start, end, len(content))
+    }, content[start:end + 1]
+
+
+def serve_export(drive, file_id, params, headers):
+    with drive.lock:
+        drive.calls["files.export"] += 1
+        if file_id not in drive.files:
+            return 404, {}, error_payload(404, "notFound")
+        content = drive.contents.get(file_id, b"")
+    # Exports ignore Range requests, as the real API does
+    return 200, {"Content-Type": params.get("mimeType", "text/plain")}, content
+
+
+def apply_metadata(drive, item, params, metadata):
+    for key, value in metadata.items():
+        if key in ("id", "size", "md5Checksum"):
+            continue
+        item[key] = value
+    parents = list(item.get("parents") or [])
+    for parent_id in (params.get("removeParents") or "").split(","):
+        if parent_id and parent_id in parents:
+            parents.remove(parent_id)
+    for parent_id in (params.get("addParents") or "").split(","):
+        if parent_id and parent_id not in parents:
+            parents.append(drive.resolve_id(parent_id))
+    item["parents"] = [drive.resolve_id(parent_id) for parent_id in parents]
+    drive_id = drive.files.get(item["parents"][0], {}).get("driveId") if item["parents"] else None
+    if drive_id:
+        item["driveId"] = drive_id
+    item["modifiedTime"] = drive.timestamp()
+
+
+def serve_create(drive, params, metadata, content):
+    # Callers count the request, as uploads create files through their own endpoints
+    with drive.lock:
+        item = {
+            "id": drive.new_id(),
+            "name": "Untitled",
+            "mimeType": metadata.get("mimeType", "application/octet-stream"),
+            "parents": [MY_DRIVE_ROOT_ID],
+            "createdTime": drive.timestamp(),
+            "trashed": False
+        }
+        apply_metadata(drive, item, params, metadata)
+        drive.files[item["id"]] = item
+        if content is not None or item["mimeType"] != FOLDER:
+            drive.set_content(item, content or b"")
+        drive.record_change(item)
+        return 200, {}, project(public_view(item), params.get("fields") or "id")
+
+
+def serve_update(drive, file_id, params, metadata, content):
+    with drive.lock:
+        item = drive.files.get(file_id)
+        if item is None:
+            return 404, {}, error_payload(404, "notFound")
+        apply_metadata(drive, item, params, metadata)
+        if content is not None:
+            drive.set_content(item, content)
+        drive.record_change(item)
+        return 200, {}, project(public_view(item), params.get("fields") or "id")
+
+
+def serve_delete(drive, file_id):
+    with drive.lock:
+        drive.calls["files.delete"] += 1
+        item = drive.files.pop(file_id, None)
+        if item is None:
+            return 404, {}, error_payload(404, "notFound")
+        drive.record_change(item, removed=True)
+        return 204, {}, None
+
+
+def serve_upload(drive, method, file_id, params, headers, body):
+    upload_type = params.get("uploadType")
+    if upload_type == "multipart":
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            "Content-Type: {}\r\n\r\n".format(headers.get("content-type") or headers.get("Content-Type")).encode("utf-8") + body
+        )
+        parts = list(message.iter_parts())
+        metadata = json.loads(parts[0].get_payload(decode=True) or b"{}")
+        content = parts[1].get_payload(decode=True) if len(parts) > 1 else b""
+        with drive.lock:
+            drive.calls["upload.multipart"] += 1
+        if file_id:
+            return serve_update(drive, drive.resolve_id(file_id), params, metadata, content)
+        return serve_create(drive, params, metadata, content)
+    if upload_type == "resumable":
+        with drive.lock:
+            drive.calls["upload.resumable_start"] += 1
+            session_id = drive.new_id("session")
+            drive.upload_sessions[session_id] = {
+                "file_id": drive.resolve_id(file_id) if file_id else None,
+                "params": params,
+                "metadata": json.loads(body or b"{}"),
+                "content": bytearray()
+            }
+        host = headers.get("host") or headers.get("Host")
+        return 200, {"Location": "http://{}/upload/session/{}".format(host, session_id)}, b""
+    if upload_type == "media":
+        with drive.lock:
+            drive.calls["upload.media"] += 1
+        if file_id:
+            return serve_update(drive, drive.resolve_id(file_id), params, {}, body)
+        return serve_create(drive, params, {}, body)
+    return 400, {}, error_payload(400, "badRequest", "Unsupported uploadType")
+
+
+def serve_resumable_chunk(drive, session_id, headers, body):
+    with drive.lock:
+        drive.calls["upload.resumable_chunk"] += 1
+        session = drive.upload_sessions.get(session_id)
+        if session is None:
+            return 404, {}, error_payload(404, "notFound")
+        content_range = headers.get("content-range") or headers.get("Content-Range") or ""
+        total = None
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        if match:
+            start = int(match.group(1))
+            if start != len(session["content"]):
+                return 400, {}, error_payload(400, "badRequest", "Unexpected chunk offset")
+            session["content"].extend(body)
+            total = None if match.group(3) == "*" else int(match.group(3))
+        else:
+            match = re.match(r"bytes \*/(\d+|\*)", content_range)
+            if match and match.group(1) != "*":
+                total = int(match.group(1))
+            elif not content_range and not body:
+                total = len(session["content"])
+        if total is None or len(session["content"]) < total:
+            headers = {}
+            if session["content"]:
+                headers["Range"] = "bytes=0-{}".format(len(session["content"]) - 1)
+            return 308, headers, b""
+        del drive.upload_sessions[session_id]
+    content = bytes(session["content"])
+    if session["file_id"]:
+        return serve_update(drive, session["file_id"], session["params"], session["metadata"], content)
+    return serve_create(drive, session["params"], session["metadata"], content)
+
+
+def serve_changes(drive, params):
+    with drive.lock:
+        drive.calls["changes.list"] += 1
+        offset = int(params["pageToken"])
+        page_size = min(int(params.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = drive.changes[offset:offset + page_size]
+        changes = []
+        for change in page:
+            change = copy.deepcopy(change)
+            if change["file"] is not None:
+                current = drive.files.get(change["fileId"])
+                if current is None:
+                    change["removed"] = True
+                    change["file"] = None
+                else:
+                    change["file"] = public_view(current)
+                    change["file"]["trashed"] = drive.is_trashed(current)
+            changes.append(change)
+        response = {"changes": changes}
+        if offset + page_size < len(drive.changes):
+            response["nextPageToken"] = str(offset + page_size)
+        else:
+            response["newStartPageToken"] = str(len(drive.changes))
+        return 200, {}, response
+
+
+def serve_batch(drive, headers, body):
+    with drive.lock:
+        drive.calls["batch"] += 1
+    content_type = headers.get("content-type") or headers.get("Content-Type")
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        "Content-Type: {}\r\n\r\n".format(content_type).encode("utf-8") + body
+    )
+    boundary = "batch_fake_drive_boundary"
+    output = []
+    for part in message.iter_parts():
+        payload = part.get_payload(decode=True)
+        request_line, rest = payload.split(b"\n", 1)
+        inner_method, inner_path, _ = request_line.decode("utf-8").split(" ", 2)
+        inner = BytesParser(policy=policy.HTTP).parsebytes(rest)
+        inner_headers = dict(inner.items())
+        inner_body = inner.get_payload(decode=True) or b""
+        status = drive.maybe_fail()
+        if status is not None:
+            with drive.lock:
+                drive.calls["error.{}".format(status)] += 1
+            response_headers = {}
+            payload = error_payload(status, ERROR_REASONS.get(status, "error"))
+        else:
+            status, response_headers, payload = route(drive, inner_method, inner_path, inner_headers, inner_body)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+            response_headers["Content-Type"] = "application/json; charset=UTF-8"
+        elif payload is None:
+            payload = ""
+        elif isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        response = "HTTP/1.1 {} OK\r\n".format(status)
+        for key, value in response_headers.items():
+            response += "{}: {}\r\n".format(key, value)
+        response += "\r\n" + payload
+        output.append(
+            "--{}\r\nContent-Type: application/http\r\nContent-ID: {}\r\n\r\n{}\r\n".format(
+                boundary,
+                (part["Content-ID"] or "").replace("<", "<response-", 1),
+                response
+            )
+        )
+    output.append("--{}--\r\n".format(boundary))
+    return 200, {"Content-Type": "multipart/mixed; boundary={}".format(boundary)}, "".join(output).encode("utf-8")
+
+
+class FakeDriveServer(object):
+    """
+    Serves a FakeDrive over HTTP on localhost, in a background thread
+    """
+    def __init__(self, drive=None, discovery_document_path=None):
+        self.drive = drive or FakeDrive()
+        handler = type("BoundFakeDriveHandler", (FakeDriveHandler,), {"drive": self.drive})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        if discovery_document_path:
+            with open(discovery_document_path) as discovery_file:
+                document = json.load(discovery_file)
+            document["rootUrl"] = self.url
+            document["baseUrl"] = self.url + document["servicePath"]
+            document["batchPath"] = "batch/drive/v3"
+            handler.discovery_document = document
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def discovery_url(self):
+        return self.url + "discovery"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,259 @@
+"""
+Benchmark of the Google Drive FS provider against a local fake Drive v3 server.
+
+For each tree shape, the fake server runs in a child process so that its memory is not counted, and
+every operation (stat, browse, enumerate, probe, read, read_dataset, write, write_dataset, rename) runs on a fresh provider,
+closed as part of the measure so that background work is counted. The number of API calls
+seen by the server, the connections opened, the wall time and the peak Python memory of the operation are reported.
+
+The provider extends dataiku.fsprovider.FSProvider. When the dataiku package is not importable, for example
+outside of a DSS code env, a minimal stand-in from the stubs directory is used instead. With --check, the run fails when an operation makes more
+API calls than allowed in budgets.json, so that round-trip regressions show up in CI.
+
+    python tests/python/benchmark/run_benchmark.py --shapes wide,deep --check
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from urllib.request import Request, urlopen
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIRECTORY = os.path.abspath(os.path.join(BENCHMARK_DIRECTORY, "..", "..", ".."))
+sys.path.insert(0, os.path.join(PLUGIN_DIRECTORY, "python-lib"))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+try:
+    import dataiku.fsprovider  # noqa: F401
+except ImportError:
+    sys.path.append(os.path.join(BENCHMARK_DIRECTORY, "stubs"))
+
+from fake_drive_server import FakeDrive, FakeDriveServer  # noqa: E402
+from tree_generator import GENERATORS, generate_tree  # noqa: E402
+
+DISCOVERY_DOCUMENT = os.path.join(PLUGIN_DIRECTORY, "python-lib", "dku_googledrive", "drive.v3.json")
+BUDGETS = os.path.join(BENCHMARK_DIRECTORY, "budgets.json")
+PROVIDER = os.path.join(PLUGIN_DIRECTORY, "python-fs-providers", "googledrive-googledrive", "fs-provider.py")
+# rename comes last, as it changes the tree
+OPERATIONS = ["stat", "browse", "enumerate", "probe", "read", "read_dataset", "write", "write_dataset", "rename"]
+READ_DATASET_MAX_FILES = 100
+WRITE_DATASET_FILE_COUNT = 100
+WRITE_DATASET_FILE_SIZE = 1024
+
+
+class NullStream():
+    """
+    Writable stream dropping what it receives
+    """
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size = self.size + len(data)
+
+
+class ZeroStream():
+    """
+    Readable stream of size zero bytes, generated on the fly
+    """
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining
+        size = min(size, self.remaining)
+        self.remaining = self.remaining - size
+        return b"\0" * size
+
+
+class FakeDriveClient():
+    """
+    Talks to the control endpoints of a fake Drive server
+    """
+    def __init__(self, url):
+        self.url = url
+
+    def call(self, action, settings=None):
+        data = json.dumps(settings or {}).encode("utf-8") if action != "stats" else None
+        response = urlopen(Request(self.url + "_fake/" + action, data=data))
+        return json.loads(response.read().decode("utf-8"))
+
+    def get_stats(self):
+        return self.call("stats")
+
+    def reset(self):
+        return self.call("reset", {})
+
+    def configure(self, **settings):
+        return self.call("configure", settings)
+
+
+def serve_tree(shape, connection):
+    drive = FakeDrive()
+    paths = generate_tree(drive, shape)
+    with FakeDriveServer(drive, DISCOVERY_DOCUMENT) as server:
+        connection.send((server.url, server.discovery_url, paths))
+        connection.recv()
+
+
+def load_provider_class():
+    spec = importlib.util.spec_from_file_location("googledrive_fs_provider", PROVIDER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GoogleDriveFSProvider
+
+
+def use_fake_server(discovery_url):
+    import dku_googledrive.client_pool as client_pool_module
+    # The fake server serves the bundled document with its own URLs
+    discovery_document = json.loads(urlopen(discovery_url).read().decode("utf-8"))
+    client_pool_module.load_discovery_document = lambda: discovery_document
+    # Clients of the previous shape talk to another server. Within a shape, they are shared like in a DSS process
+    client_pool_module.client_pool.clear()
+
+
+def make_provider(provider_class, extra_config=None):
+    config = {
+        "auth_type": "oauth",
+        "oauth_credentials": {"access_token": "benchmark"},
+        "node_wide_quota": False
+    }
+    config.update(extra_config or {})
+    return provider_class("", config, {})
+
+
+def run_operation(provider, operation, paths):
+    if operation == "stat":
+        provider.stat(paths["stat"])
+    elif operation == "browse":
+        provider.browse(paths["browse"])
+    elif operation == "enumerate":
+        provider.enumerate(paths["enumerate"], False)
+    elif operation == "probe":
+        # What DSS does to check that a folder holds data
+        provider.enumerate(paths["enumerate"], True)
+    elif operation == "read":
+        provider.read(paths["read"], NullStream(), -1)
+    elif operation == "read_dataset":
+        # What DSS does to read a dataset: list the files, then read them one by one
+        for entry in provider.enumerate(paths["enumerate"], False)[:READ_DATASET_MAX_FILES]:
+            provider.read(entry["path"], NullStream(), -1)
+    elif operation == "write":
+        provider.write(paths["write"], ZeroStream(paths["write_size"]))
+    elif operation == "write_dataset":
+        # What DSS does to write a partitioned output: many small files in a new folder
+        folder = os.path.dirname(paths["write"]) + "/new_dataset"
+        for index in range(WRITE_DATASET_FILE_COUNT):
+            provider.write("{}/part_{:05d}.csv".format(folder, index), ZeroStream(WRITE_DATASET_FILE_SIZE))
+    elif operation == "rename":
+        provider.move(paths["read"], paths["read"] + ".renamed")
+
+
+def benchmark_shape(shape, operations, provider_class, latency, error_rate, extra_config=None):
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target=serve_tree, args=(shape, child_connection))
+    server_process.start()
+    results = []
+    try:
+        url, discovery_url, paths = parent_connection.recv()
+        client = FakeDriveClient(url)
+        client.configure(latency=latency, error_rate=error_rate)
+        use_fake_server(discovery_url)
+        for operation in operations:
+            provider = make_provider(provider_class, extra_config)
+            # Building the API client is not part of the measure
+            provider.session.drive
+            client.reset()
+            tracemalloc.start()
+            start = time.time()
+            run_operation(provider, operation, paths)
+            provider.close()
+            wall_time = time.time() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stats = client.get_stats()
+            calls = dict((name, count) for name, count in stats["calls"].items() if not name.startswith("error."))
+            results.append({
+                "shape": shape,
+                "operation": operation,
+                "api_calls": sum(calls.values()),
+                "calls": calls,
+                "errors": sum(count for name, count in stats["calls"].items() if name.startswith("error.")),
+                "wall_time": wall_time,
+                "peak_memory": peak_memory,
+                "bytes_sent": stats["bytes_sent"],
+                "bytes_received": stats["bytes_received"],
+                "connections": stats["connections"]
+            })
+    finally:
+        parent_connection.send("stop")
+        server_process.join()
+    return results
+
+
+def check_budgets(results):
+    with open(BUDGETS) as budgets_file:
+        budgets = json.load(budgets_file)
+    failures = []
+    for result in results:
+        budget = budgets.get(result["shape"], {}).get(result["operation"])
+        if budget is not None and result["api_calls"] > budget:
+            failures.append("{} {}: {} API calls, budget is {}".format(
+                result["shape"], result["operation"], result["api_calls"], budget
+            ))
+    return failures
+
+
+def print_results(results):
+    print("{:<12} {:<13} {:>9} {:>7} {:>11} {:>10} {:>12}  {}".format(
+        "shape", "operation", "api calls", "errors", "connections", "wall (s)", "peak (KB)", "calls"
+    ))
+    for result in results:
+        print("{:<12} {:<13} {:>9} {:>7} {:>11} {:>10.3f} {:>12.0f}  {}".format(
+            result["shape"],
+            result["operation"],
+            result["api_calls"],
+            result["errors"],
+            result["connections"],
+            result["wall_time"],
+            result["peak_memory"] / 1024.0,
+            json.dumps(result["calls"], sort_keys=True)
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Google Drive FS provider against a fake Drive server")
+    parser.add_argument("--shapes", default=",".join(sorted(GENERATORS)), help="comma separated tree shapes")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="comma separated operations")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each HTTP request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 403, 429 or 503")
+    parser.add_argument("--config", help="JSON dict of provider settings, such as '{\"read_ahead_files\": 4}'")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--check", action="store_true", help="fail when an operation exceeds its API call budget")
+    args = parser.parse_args()
+
+    provider_class = load_provider_class()
+    extra_config = json.loads(args.config) if args.config else {}
+    results = []
+    for shape in args.shapes.split(","):
+        results.extend(benchmark_shape(
+            shape, args.operations.split(","), provider_class, args.latency, args.error_rate, extra_config
+        ))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+    if args.check:
+        failures = check_budgets(results)
+        for failure in failures:
+            print("Over budget: {}".format(failure))
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
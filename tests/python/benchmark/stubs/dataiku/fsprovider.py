@@ -0,0 +1,9 @@
+class FSProvider(object):
+    """
+    Minimal stand-in of the DSS FS provider base class, so that the provider can be benchmarked outside of DSS
+    """
+    def __init__(self, root, config, plugin_config):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,97 @@
+"""
+Synthetic Google Drive trees for the benchmark, each returned with the paths the benchmarked operations target
+"""
+from fake_drive_server import MY_DRIVE_ROOT_ID
+
+KILOBYTE = 1024
+MEGABYTE = 1024 * KILOBYTE
+
+
+def generate_wide(drive, file_count=3000):
+    """
+    One folder holding many files
+    """
+    folder_id = drive.add_folder("wide", MY_DRIVE_ROOT_ID)
+    for index in range(file_count):
+        drive.add_file("file_{:05d}.csv".format(index), folder_id, b"a,b\n1,2\n")
+    return {
+        "stat": "/wide/file_{:05d}.csv".format(file_count - 1),
+        "browse": "/wide",
+        "enumerate": "/wide",
+        "read": "/wide/file_00000.csv",
+        "write": "/wide/new_file.csv",
+        "write_size": KILOBYTE
+    }
+
+
+def generate_deep(drive, depth=20):
+    """
+    A chain of nested folders, each with a file
+    """
+    parent_id = MY_DRIVE_ROOT_ID
+    path = ""
+    for level in range(depth):
+        parent_id = drive.add_folder("level_{:02d}".format(level), parent_id)
+        path = path + "/level_{:02d}".format(level)
+        drive.add_file("data.csv", parent_id, b"a,b\n1,2\n")
+    return {
+        "stat": path + "/data.csv",
+        "browse": path,
+        "enumerate": "/level_00",
+        "read": path + "/data.csv",
+        "write": path + "/new_folder/new_file.csv",
+        "write_size": KILOBYTE
+    }
+
+
+def generate_small_files(drive, folder_count=20, files_per_folder=100, file_size=KILOBYTE):
+    """
+    A partitioned dataset: many folders of many small files
+    """
+    root_id = drive.add_folder("small_files", MY_DRIVE_ROOT_ID)
+    content = b"x" * file_size
+    for folder_index in range(folder_count):
+        folder_id = drive.add_folder("partition_{:03d}".format(folder_index), root_id)
+        for file_index in range(files_per_folder):
+            drive.add_file("part_{:05d}.csv".format(file_index), folder_id, content)
+    return {
+        "stat": "/small_files/partition_{:03d}/part_{:05d}.csv".format(folder_count - 1, files_per_folder - 1),
+        "browse": "/small_files/partition_000",
+        "enumerate": "/small_files",
+        "read": "/small_files/partition_000/part_00000.csv",
+        "write": "/small_files/partition_new/part_00000.csv",
+        "write_size": file_size
+    }
+
+
+def generate_huge_files(drive, file_count=2, file_size=32 * MEGABYTE):
+    """
+    A few large files
+    """
+    folder_id = drive.add_folder("huge_files", MY_DRIVE_ROOT_ID)
+    content = b"x" * file_size
+    for index in range(file_count):
+        drive.add_file("huge_{:02d}.bin".format(index), folder_id, content, mime_type="application/octet-stream")
+    return {
+        "stat": "/huge_files/huge_00.bin",
+        "browse": "/huge_files",
+        "enumerate": "/huge_files",
+        "read": "/huge_files/huge_00.bin",
+        "write": "/huge_files/new_huge.bin",
+        "write_size": file_size
+    }
+
+
+GENERATORS = {
+    "wide": generate_wide,
+    "deep": generate_deep,
+    "small_files": generate_small_files,
+    "huge_files": generate_huge_files
+}
+
+
+def generate_tree(drive, shape):
+    """
+    Fill drive with the tree of the given shape and return the paths to benchmark on it
+    """
+    return GENERATORS[shape](drive)
@@ -0,0 +1,33 @@
+import pytest
+from dku_googledrive.client_pool import ClientPool, load_discovery_document
+from dku_googledrive.session import GoogleDriveSession
+
+
+class TestClientPool:
+
+    def test_clients_are_shared_by_credentials(self):
+        pool = ClientPool(max_size=2)
+        created = []
+
+        def create_credentials():
+            created.append(1)
+            return object()
+
+        first = pool.get(["token_a"], create_credentials, None)
+        assert pool.get(["token_a"], create_credentials, None) is first
+        assert pool.get(["token_b"], create_credentials, None) is not first
+        assert len(created) == 2
+        pool.get(["token_c"], create_credentials, None)
+        assert pool.get(["token_a"], create_credentials, None) is not first
+        assert len(created) == 4
+
+    def test_bundled_discovery_document(self):
+        document = load_discovery_document()
+        assert document["id"] == "drive:v3"
+        assert load_discovery_document() is document
+
+    def test_credentials_parsing(self):
+        assert GoogleDriveSession.get_credentials_dict('{"type": "service_account"}') == {"type": "service_account"}
+        assert GoogleDriveSession.get_credentials_dict("{'type': 'service_account'}") == {"type": "service_account"}
+        with pytest.raises(ValueError):
+            GoogleDriveSession.get_credentials_dict("__import__('os')")
@@ -0,0 +1,70 @@
+import errno
+import os
+from io import BytesIO
+
+from dku_googledrive.content_cache import ContentCache, TeeStreamWriter
+
+
+def add_content(cache, key, content):
+    writer = cache.create_writer(key)
+    writer.write(content)
+    writer.commit()
+
+
+class FullDiskFile():
+    """
+    Temporary file of a cache on a full disk, accepting the first write only
+    """
+    def __init__(self, file):
+        self.file = file
+        self.name = file.name
+        self.writes = 0
+
+    def write(self, data):
+        self.writes = self.writes + 1
+        if self.writes > 1:
+            raise IOError(errno.ENOSPC, "No space left on device")
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class TestContentCache:
+
+    def test_key_depends_on_version(self):
+        item = {'id': 'file_id', 'modifiedTime': '2024-01-01T00:00:00.000Z', 'md5Checksum': 'abc'}
+        modified_item = dict(item, modifiedTime='2024-01-02T00:00:00.000Z')
+        assert ContentCache.get_key(item) != ContentCache.get_key(modified_item)
+        assert ContentCache.get_key(item) != ContentCache.get_key(item, export_mime_type="text/csv")
+        assert ContentCache.get_key({'id': 'file_id'}) is None
+
+    def test_add_and_evict(self, tmpdir):
+        cache = ContentCache(str(tmpdir.join("cache")), max_size=10)
+        add_content(cache, "a", b"123456")
+        with cache.open("a") as cached_file:
+            assert cached_file.read() == b"123456"
+        os.utime(cache.get_path("a"), (0, 0))
+        add_content(cache, "b", b"7890")
+        add_content(cache, "c", b"12")
+        assert cache.open("a") is None
+        assert cache.open("b") is not None
+        writer = cache.create_writer("d")
+        writer.write(b"partial")
+        writer.discard()
+        assert cache.open("d") is None
+        assert sorted(os.listdir(cache.directory)) == ["b", "c"]
+
+    def test_failing_cache_write_does_not_break_the_download(self, tmpdir):
+        cache = ContentCache(str(tmpdir.join("cache")), max_size=100)
+        writer = cache.create_writer("a")
+        writer.file = FullDiskFile(writer.file)
+        stream = BytesIO()
+        tee = TeeStreamWriter(stream, writer)
+        for data in [b"12", b"34", b"56"]:
+            tee.write(data)
+        writer.commit()
+        assert stream.getvalue() == b"123456"
+        assert writer.file.writes == 2
+        assert cache.open("a") is None
+        assert os.listdir(cache.directory) == []
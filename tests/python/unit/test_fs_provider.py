@@ -0,0 +1,115 @@
+import importlib.util
+import os
+import sys
+import time
+
+PLUGIN_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+PROVIDER = os.path.join(PLUGIN_DIRECTORY, "python-fs-providers", "googledrive-googledrive", "fs-provider.py")
+try:
+    import dataiku.fsprovider  # noqa: F401
+except ImportError:
+    # Same stand-in of the DSS base class as the benchmark
+    sys.path.append(os.path.join(PLUGIN_DIRECTORY, "tests", "python", "benchmark", "stubs"))
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+def load_provider_class():
+    spec = importlib.util.spec_from_file_location("googledrive_fs_provider", PROVIDER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GoogleDriveFSProvider
+
+
+class FakeRequest():
+    methodId = "drive.files.update"
+
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self, num_retries=0):
+        return self.response
+
+
+class FakeFiles():
+    def __init__(self):
+        self.updates = []
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+        return FakeRequest({'id': kwargs['fileId'], 'parents': [kwargs.get('addParents', "folder_id")]})
+
+
+class FakeDrive():
+    def __init__(self):
+        self.fake_files = FakeFiles()
+
+    def files(self):
+        return self.fake_files
+
+
+class FakeClients():
+    def __init__(self, drive):
+        self.drive = drive
+        self.credentials = None
+
+    def get_drive(self):
+        return self.drive
+
+
+def get_provider():
+    config = {"auth_type": "oauth", "oauth_credentials": {"access_token": "test"}, "queries_per_100_seconds": 0}
+    provider = load_provider_class()("", config, {})
+    provider.session.clients = FakeClients(FakeDrive())
+    return provider
+
+
+def fail_path_resolution(path):
+    raise AssertionError("{} should not be resolved".format(path))
+
+
+class TestGoogleDriveFSProvider:
+
+    def test_just_written_file_is_renamed_from_the_folder_index(self):
+        provider = get_provider()
+        session = provider.session
+        session.known_directories.set(["folder"], ["folder_id"])
+        session.folder_indexes["folder_id"] = (time.time(), {"data.csv": "data_id"})
+        session.get_item_from_path = fail_path_resolution
+        assert provider.move("/folder/data.csv", "/folder/renamed.csv")
+        updates = session.clients.drive.fake_files.updates
+        assert len(updates) == 1
+        assert updates[0]['fileId'] == "data_id"
+        assert updates[0]['body'] == {'name': "renamed.csv"}
+        assert "addParents" not in updates[0] and "removeParents" not in updates[0]
+        assert session.folder_indexes["folder_id"][1] == {"renamed.csv": "data_id"}
+        provider.close()
+
+    def test_missing_destination_folders_are_created(self):
+        provider = get_provider()
+        session = provider.session
+        data = {'id': "data_id", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder_id"]}
+        session.get_item_from_path = lambda path: data if path == "/folder/data.csv" else None
+        session.googledrive_list = lambda query, fields=None: []
+        created = []
+
+        def create_directory(name, parent_ids):
+            created.append((name, parent_ids))
+            return name + "_id"
+
+        session.create_directory = create_directory
+        assert provider.move("/folder/data.csv", "/other/sub/moved.csv")
+        assert created == [("other", ["root"]), ("sub", ["other_id"])]
+        updates = session.clients.drive.fake_files.updates
+        assert len(updates) == 1
+        assert updates[0]['body'] == {'name': "moved.csv"}
+        assert updates[0]['addParents'] == "sub_id"
+        assert updates[0]['removeParents'] == "folder_id"
+        provider.close()
+
+    def test_missing_source_is_not_moved(self):
+        provider = get_provider()
+        provider.session.get_item_from_path = lambda path: None
+        assert not provider.move("/folder/missing.csv", "/folder/renamed.csv")
+        assert provider.session.clients.drive.fake_files.updates == []
+        provider.close()
@@ -9,3 +9,38 @@ class TestCommonMethods:
         directory = {'mimeType': "application/vnd.google-apps.folder"}
         assert GoogleDriveUtils.is_directory(not_a_directory) == False
         assert GoogleDriveUtils.is_directory(directory) == True
+
+    def test_split_ids_for_query(self):
+        ids = ["folder_id_{}".format(index) for index in range(100)]
+        batches = GoogleDriveUtils.split_ids_for_query(ids, max_query_length=500)
+        assert [id for batch in batches for id in batch] == ids
+        assert len(batches) > 1
+        for batch in batches:
+            assert len(GoogleDriveUtils.query_parents_in(batch, trashed=False)) <= 500
+
+    def test_query_escaping(self):
+        assert GoogleDriveUtils.query_parents_in(["folder_id"], name="it's") == "('folder_id' in parents) and name='it\\'s'"
+        assert GoogleDriveUtils.query_names_in(["a\\b", "c"], trashed=False) == "(name='a\\\\b' or name='c') and trashed=false"
+
+    def test_split_names_for_query(self):
+        names = ["name_{}".format(index) for index in range(100)]
+        batches = GoogleDriveUtils.split_names_for_query(names, max_query_length=500)
+        assert [name for batch in batches for name in batch] == names
+        for batch in batches:
+            assert len(GoogleDriveUtils.query_names_in(batch, trashed=False)) <= 500
+
+    def test_walk_tree_is_lazy(self):
+        folder = {'id': "folder", 'name': "folder", 'mimeType': "application/vnd.google-apps.folder"}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv"}
+        children = {"root": [folder], "folder": [data]}
+        listed_levels = []
+
+        def get_children_of(folder_ids):
+            listed_levels.append(folder_ids)
+            return [(folder_id, child) for folder_id in folder_ids for child in children.get(folder_id, [])]
+
+        entries = GoogleDriveUtils.walk_tree(["root"], get_children_of)
+        assert next(entries) == ("/folder", folder)
+        assert listed_levels == [["root"]]
+        assert list(entries) == [("/folder/data.csv", data)]
+        assert listed_levels == [["root"], ["folder"]]
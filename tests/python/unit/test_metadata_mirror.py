@@ -0,0 +1,90 @@
+import os
+import sqlite3
+
+from dku_googledrive.metadata_mirror import MetadataMirror
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+class FakeSession():
+    def __init__(self, entries):
+        self.root_id = "root"
+        self.drive = None
+        self.entries = entries
+        self.contexts = []
+        self.on_list = None
+
+    def googledrive_execute(self, build_request, context=""):
+        self.contexts.append(context)
+        responses = {
+            "get": {'id': "root_id"},
+            "about": {'user': {'permissionId': "permission_id"}},
+            "changes": {'startPageToken': "1"}
+        }
+        return responses[context]
+
+    def googledrive_list_tree(self, folders):
+        if self.on_list is not None:
+            self.on_list()
+        return self.entries
+
+
+class TestMetadataMirror:
+
+    def test_own_writes_are_recorded_without_the_changes_feed(self, tmp_path):
+        folder = {'id': "folder", 'name': "folder", 'mimeType': FOLDER, 'parents': ["root_id"]}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        session = FakeSession([("/folder", folder), ("/folder/data.csv", data)])
+        mirror = MetadataMirror(session, max_staleness=3600, directory=str(tmp_path))
+        assert mirror.get_children("folder") == [data]
+
+        written = {'id': "written", 'name': "written.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        mirror.record_item(written)
+        renamed = dict(data, name="renamed.csv")
+        mirror.record_item(renamed)
+        assert sorted(mirror.get_children("folder"), key=lambda item: item['id']) == [renamed, written]
+
+        mirror.record_item(dict(written, parents=["outside"]))
+        assert mirror.get_children("folder") == [renamed]
+
+        mirror.record_removal(["folder"])
+        assert mirror.get_children("root") == []
+        assert mirror.get_items_from_path(["folder", "renamed.csv"]) == []
+        assert "changes" not in session.contexts[3:]
+
+    def test_mirror_is_seeded_in_a_single_transaction(self, tmp_path):
+        folder = {'id': "folder", 'name': "folder", 'mimeType': FOLDER, 'parents': ["root_id"]}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        session = FakeSession([("/folder", folder), ("/folder/data.csv", data)])
+        mirror = MetadataMirror(session, max_staleness=3600, directory=str(tmp_path))
+        assert mirror.get_children("folder") == [data]
+
+        def count_items():
+            database_path = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+            connection = sqlite3.connect(database_path)
+            try:
+                return connection.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            finally:
+                connection.close()
+
+        # Seeded again, other processes keep reading the previous items until the new ones are written
+        counts = []
+        session.on_list = lambda: counts.append(count_items())
+        with mirror.connection:
+            mirror.connection.execute("DELETE FROM state")
+        mirror.stale = True
+        assert mirror.get_children("folder") == [data]
+        assert counts == [2]
+
+    def test_mirror_seeded_meanwhile_is_kept(self, tmp_path):
+        folder = {'id': "folder", 'name': "folder", 'mimeType': FOLDER, 'parents': ["root_id"]}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        other = {'id': "other", 'name': "other.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        first_session = FakeSession([("/folder", folder), ("/folder/data.csv", data)])
+        second_session = FakeSession([("/folder", folder), ("/folder/data.csv", data), ("/folder/other.csv", other)])
+        first_mirror = MetadataMirror(first_session, max_staleness=3600, directory=str(tmp_path))
+        second_mirror = MetadataMirror(second_session, max_staleness=3600, directory=str(tmp_path))
+        # Another process seeds the same mirror while the first one is listing
+        first_session.on_list = lambda: second_mirror.sync_if_stale()
+        children = sorted(first_mirror.get_children("folder"), key=lambda item: item['id'])
+        assert children == [data, other]
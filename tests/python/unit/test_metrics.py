@@ -0,0 +1,33 @@
+from dku_googledrive.metrics import SessionMetrics
+
+
+class TestSessionMetrics:
+
+    def test_api_calls(self):
+        metrics = SessionMetrics(latency_buckets=[0.1, 1])
+        metrics.record_api_call("drive.files.list", 0.05)
+        metrics.record_api_call("drive.files.list", 2, failed=True)
+        try:
+            with metrics.api_call("drive.files.get"):
+                raise ValueError()
+        except ValueError:
+            pass
+        summary = metrics.get_summary()
+        files_list = summary["api_calls"]["drive.files.list"]
+        assert files_list["count"] == 2
+        assert files_list["errors"] == 1
+        assert files_list["latency_histogram"] == {"<=0.1s": 1, ">1s": 1}
+        assert summary["api_calls"]["drive.files.get"]["errors"] == 1
+        assert summary["total_api_calls"] == 3
+
+    def test_counters(self):
+        metrics = SessionMetrics()
+        metrics.add("pages")
+        metrics.add("bytes_downloaded", 100)
+        with metrics.operation("download"):
+            pass
+        summary = metrics.get_summary()
+        assert summary["pages"] == 1
+        assert summary["bytes_downloaded"] == 100
+        assert summary["retries"] == 0
+        assert summary["operations"]["download"]["count"] == 1
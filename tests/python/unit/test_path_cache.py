@@ -0,0 +1,33 @@
+from dku_googledrive.path_cache import PathCache
+
+
+class TestPathCache:
+
+    def test_longest_prefix(self):
+        cache = PathCache()
+        cache.set(['a'], [{'id': 'a_id'}])
+        cache.set(['a', 'b'], [{'id': 'b_id'}])
+        assert cache.get_longest_prefix(['a', 'b', 'c']) == (2, [{'id': 'b_id'}])
+        assert cache.get_longest_prefix(['x', 'b']) == (0, None)
+
+    def test_invalidate_subtree(self):
+        cache = PathCache()
+        cache.set(['a'], [{'id': 'a_id'}])
+        cache.set(['a', 'b'], [{'id': 'b_id'}])
+        cache.set(['ab'], [{'id': 'ab_id'}])
+        cache.invalidate('/a/')
+        assert cache.get(['a']) is None
+        assert cache.get(['a', 'b']) is None
+        assert cache.get(['ab']) == [{'id': 'ab_id'}]
+
+    def test_lru_and_ttl(self):
+        cache = PathCache(max_size=2)
+        cache.set(['a'], [{'id': 'a_id'}])
+        cache.set(['b'], [{'id': 'b_id'}])
+        cache.get(['a'])
+        cache.set(['c'], [{'id': 'c_id'}])
+        assert cache.get(['b']) is None
+        assert cache.get(['a']) == [{'id': 'a_id'}]
+        expired_cache = PathCache(ttl=-1)
+        expired_cache.set(['a'], [{'id': 'a_id'}])
+        assert expired_cache.get(['a']) is None
@@ -0,0 +1,65 @@
+import io
+import threading
+
+from dku_googledrive.read_ahead import ReadAhead
+
+
+class FakeSession():
+    def __init__(self):
+        self.downloaded = []
+        self.lock = threading.Lock()
+
+    def googledrive_download(self, item, stream, limit=None):
+        with self.lock:
+            self.downloaded.append((item['id'], limit))
+        content = item['id'].encode("utf-8") * 10
+        stream.write(content[:limit] if limit and limit > 0 else content)
+
+
+def get_file(file_id, size=20):
+    return {'id': file_id, 'name': file_id, 'mimeType': "text/csv", 'size': str(size)}
+
+
+class TestReadAhead:
+
+    def test_reads_from_spool(self):
+        session = FakeSession()
+        read_ahead = ReadAhead(session, depth=2, max_spooled_bytes=1000)
+        read_ahead.set_listing([("/a", get_file("a")), ("/b", get_file("b")), ("/c", get_file("c"))])
+        for path in ["/a", "/b", "/c"]:
+            stream = io.BytesIO()
+            assert read_ahead.read(path, stream)
+            assert stream.getvalue() == path[1:].encode("utf-8") * 10
+        stream = io.BytesIO()
+        assert read_ahead.read("/b", stream, limit=3)
+        assert stream.getvalue() == b"bbb"
+        assert not read_ahead.read("/unknown", io.BytesIO())
+        read_ahead.close()
+        assert sorted(file_id for file_id, limit in session.downloaded) == ["a", "b", "b", "c"]
+        assert read_ahead.spooled_bytes == 0
+
+    def test_spool_bound(self):
+        session = FakeSession()
+        read_ahead = ReadAhead(session, depth=4, max_spooled_bytes=30)
+        read_ahead.set_listing([("/{}".format(index), get_file(str(index))) for index in range(5)])
+        read_ahead.read("/0", io.BytesIO())
+        assert sorted(read_ahead.prefetches) == ["/1"]
+        read_ahead.close()
+
+    def test_previews_are_prefetched_up_to_their_limit(self):
+        session = FakeSession()
+        read_ahead = ReadAhead(session, depth=1, max_spooled_bytes=1000)
+        read_ahead.set_listing([("/{}".format(index), get_file(str(index))) for index in range(4)])
+        for index in range(2):
+            stream = io.BytesIO()
+            assert read_ahead.read("/{}".format(index), stream, limit=3)
+            assert stream.getvalue() == str(index).encode("utf-8") * 3
+        for index in range(2, 4):
+            stream = io.BytesIO()
+            assert read_ahead.read("/{}".format(index), stream, limit=-1)
+            assert stream.getvalue() == str(index).encode("utf-8") * 10
+        read_ahead.close()
+        # The preview prefetch of /2 may have been cancelled before it started
+        assert sorted(set(session.downloaded) - {("2", 3)}) == [("0", 3), ("1", 3), ("2", None), ("3", None)]
+        assert len(session.downloaded) <= 5
+        assert read_ahead.spooled_bytes == 0
@@ -0,0 +1,44 @@
+import json
+
+from dku_googledrive.retry_policy import RetryPolicy, SharedTokenBucket
+
+
+class FakeResponse(dict):
+    def __init__(self, status, headers=None):
+        super(FakeResponse, self).__init__(headers or {})
+        self.status = status
+
+
+class FakeHttpError():
+    def __init__(self, status, reason="", headers=None):
+        self.resp = FakeResponse(status, headers)
+        self.content = json.dumps({"error": {"errors": [{"reason": reason}]}}).encode("utf-8")
+
+
+class TestRetryPolicy:
+
+    def test_is_retryable(self):
+        policy = RetryPolicy()
+        assert policy.is_retryable(FakeHttpError(429, "rateLimitExceeded"))
+        assert policy.is_retryable(FakeHttpError(503, "backendError"))
+        assert policy.is_retryable(FakeHttpError(403, "userRateLimitExceeded"))
+        assert not policy.is_retryable(FakeHttpError(403, "insufficientFilePermissions"))
+        assert not policy.is_retryable(FakeHttpError(404, "notFound"))
+
+    def test_get_delay(self):
+        policy = RetryPolicy(base_delay=1, max_delay=8)
+        assert 0.5 <= policy.get_delay(0) <= 1
+        assert 4 <= policy.get_delay(10) <= 8
+        assert policy.get_delay(0, FakeHttpError(429, headers={'retry-after': '5'})) == 5
+
+
+class TestSharedTokenBucket:
+
+    def test_state_is_shared(self, tmpdir):
+        path = str(tmpdir.join("quota.json"))
+        first = SharedTokenBucket(path, rate=1, capacity=2)
+        second = SharedTokenBucket(path, rate=1, capacity=2)
+        assert first.take(2) == 0
+        assert second.take(1) > 0
+        first.close()
+        second.close()
@@ -0,0 +1,562 @@
+import json
+import re
+import threading
+import time
+from io import BytesIO
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import dku_googledrive.session
+
+from dku_googledrive.client_pool import build_drive
+from dku_googledrive.googledrive_utils import GoogleDriveUtils as gdu
+from dku_googledrive.retry_policy import RetryPolicy, SharedTokenBucket
+from dku_googledrive.session import GoogleDriveSession, GoogleDriveSessionError
+
+
+class FakeRequest():
+    def __init__(self, response):
+        self.methodId = "drive.files.list"
+        self.response = response
+
+    def execute(self, num_retries=0):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class FakeFiles():
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeRequest(self.pages[kwargs.get('pageToken')])
+
+    def update(self, **kwargs):
+        self.calls.append(kwargs)
+        request = FakeRequest({'id': kwargs['fileId']})
+        request.methodId = "drive.files.update"
+        request.kwargs = kwargs
+        return request
+
+
+def get_http_error(status, reason):
+    content = json.dumps({"error": {"errors": [{"reason": reason}]}}).encode("utf-8")
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+class FakeBatch():
+    """
+    Batch answering each sub-request with the next status scripted for its file, 200 once the script is over
+    """
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.drive.batches.append([request.kwargs['fileId'] for request_id, request in self.requests])
+        for request_id, request in self.requests:
+            file_id = request.kwargs['fileId']
+            statuses = self.drive.statuses.get(file_id, [])
+            status = statuses.pop(0) if statuses else 200
+            if status == 200:
+                self.callback(request_id, {'id': file_id}, None)
+            else:
+                reasons = {403: "insufficientFilePermissions", 404: "notFound", 503: "backendError"}
+                self.callback(request_id, None, get_http_error(status, reasons[status]))
+
+
+class FakeCorpusFiles():
+    """
+    Answers files.list by evaluating the simple queries of the plugin against items
+    """
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        expression = re.sub(r"name contains ('[^']*')", r"\1 in name", kwargs['q'])
+        expression = re.sub(r"\b(name|mimeType)=(?!=)", r"\1==", expression).replace("trashed=false", "True")
+        # Only the fields of the mask are returned
+        fields = re.search(r"files\(([^)]*)\)", kwargs['fields']).group(1).split(", ")
+        files = [
+            dict((key, value) for key, value in item.items() if key in fields) for item in self.items
+            if eval(expression, {}, {'name': item['name'], 'mimeType': item['mimeType'], 'parents': item.get('parents', [])})
+        ]
+        return FakeRequest({'files': files})
+
+
+class FakeDrives():
+    def __init__(self):
+        self.calls = []
+
+    def get(self, driveId, fields=None):
+        self.calls.append(driveId)
+        return FakeRequest(HttpError(httplib2.Response({"status": 404}), b'{"error": {"errors": [{"reason": "notFound"}]}}'))
+
+
+class FakeDrive():
+    def __init__(self, pages):
+        self.fake_files = FakeFiles(pages)
+        self.fake_drives = FakeDrives()
+        self.statuses = {}
+        self.batches = []
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def files(self):
+        return self.fake_files
+
+    def drives(self):
+        return self.fake_drives
+
+
+class FakeMediaHttp():
+    """
+    Serves the content of a file to media requests, honoring their Range header
+    """
+    def __init__(self, content):
+        self.content = content
+        self.ranges = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        assert "alt=media" in uri
+        self.ranges.append(headers.get("range"))
+        start, end = re.match(r"^bytes=(\d+)-(\d+)$", headers["range"]).groups()
+        data = self.content[int(start):int(end) + 1]
+        content_range = "bytes {}-{}/{}".format(start, int(start) + len(data) - 1, len(self.content))
+        return httplib2.Response({"status": 206, "content-range": content_range}), data
+
+
+class FakeCredentials():
+    def get_access_token(self, http=None):
+        pass
+
+    def apply(self, headers):
+        headers["authorization"] = "Bearer test"
+
+
+class FakeExportHttp():
+    """
+    Sends an export in chunks, like the body of a response arriving from the network
+    """
+    def __init__(self, content, chunk_size=4, failures=0):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.failures = failures
+        self.chunks_sent = 0
+        self.requests = []
+
+    def stream(self, uri, write, headers=None, is_done=None, chunk_size=None):
+        self.requests.append((uri, headers))
+        if self.failures > 0:
+            self.failures = self.failures - 1
+            return httplib2.Response({"status": 503}), b'{"error": {"errors": [{"reason": "backendError"}]}}'
+        for start in range(0, len(self.content), self.chunk_size):
+            if is_done is not None and is_done():
+                break
+            self.chunks_sent = self.chunks_sent + 1
+            write(self.content[start:start + self.chunk_size])
+        return httplib2.Response({"status": 200}), None
+
+
+class FakeClients():
+    def __init__(self, drive, http=None):
+        self.drive = drive
+        self.http = http
+        self.credentials = FakeCredentials()
+
+    def get_drive(self):
+        return self.drive
+
+    def get_http(self):
+        return self.http
+
+    def create_http(self):
+        return None
+
+
+class FakeUploadHttp():
+    """
+    Answers the Drive API requests of an upload into an empty folder, failing the first upload requests with a 503
+    """
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.uploads = []
+        self.content = bytearray()
+        self.content_ranges = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if "/upload/" not in uri and "upload.example" not in uri:
+            return httplib2.Response({"status": 200}), json.dumps({"files": []}).encode("utf-8")
+        self.uploads.append(uri)
+        if self.failures > 0:
+            self.failures = self.failures - 1
+            return httplib2.Response({"status": 503}), b'{"error": {"errors": [{"reason": "backendError"}]}}'
+        if "uploadType=resumable" in uri:
+            return httplib2.Response({"status": 200, "location": "https://upload.example/session"}), b""
+        if "uploadType=multipart" in uri:
+            return httplib2.Response({"status": 200}), b'{"id": "file_id"}'
+        content_range = headers.get("Content-Range")
+        self.content_ranges.append(content_range)
+        start, end, total = re.match(r"^bytes (\d+)-(\d+)/(\d+|\*)$", content_range).groups()
+        assert int(start) == len(self.content) and int(end) - int(start) + 1 == len(body)
+        self.content.extend(body)
+        if total == "*":
+            return httplib2.Response({"status": 308, "range": "bytes=0-{}".format(end)}), b""
+        assert int(total) == len(self.content)
+        return httplib2.Response({"status": 200}), b'{"id": "file_id"}'
+
+
+class FakeTokenInfoHttp():
+    def __init__(self, client_ids):
+        self.client_ids = client_ids
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        self.requests.append(uri)
+        assert method == "POST" and "access_token" not in uri
+        access_token = body.split("access_token=")[1]
+        if access_token not in self.client_ids:
+            return httplib2.Response({"status": 400}), b'{"error": "invalid_token"}'
+        return httplib2.Response({"status": 200}), json.dumps({"azp": self.client_ids[access_token]}).encode("utf-8")
+
+
+def get_session(pages=None, http=None, config=None):
+    session_config = {"auth_type": "oauth", "oauth_credentials": {"access_token": "test"}, "queries_per_100_seconds": 0}
+    session_config.update(config or {})
+    session = GoogleDriveSession(session_config, {})
+    session.clients = FakeClients(FakeDrive(pages) if http is None else build_drive(http), http)
+    session.retry_policy = RetryPolicy(base_delay=0)
+    return session
+
+
+class TestGoogleDriveSession:
+
+    def test_find_first_file_follows_empty_pages(self):
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        session = get_session({
+            None: {'files': [], 'nextPageToken': "page_2"},
+            "page_2": {'files': [data]}
+        })
+        folder = {'id': "folder", 'name': "folder", 'mimeType': "application/vnd.google-apps.folder"}
+        assert session.find_first_file(folder) == ("/data.csv", data)
+        calls = session.clients.drive.fake_files.calls
+        assert len(calls) == 2
+        assert calls[0]['pageSize'] == 1
+        assert "mimeType!=" in calls[0]['q']
+
+    def test_path_is_resolved_by_names_below_the_known_prefix(self):
+        folder = "application/vnd.google-apps.folder"
+        a = {'id': "a", 'name': "a", 'mimeType': folder, 'parents': ["top"]}
+        other_a = {'id': "other_a", 'name': "a", 'mimeType': folder, 'parents': ["elsewhere"]}
+        b = {'id': "b", 'name': "b", 'mimeType': folder, 'parents': ["a"]}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["b"], 'modifiedTime': "2024-01-01T00:00:00.000Z"}
+        session = get_session({None: {'files': [a, other_a, b, data]}})
+        session.path_cache.set(["top"], [{'id': "top", 'name': "top", 'mimeType': folder}])
+        assert session.get_items_from_path("/top/a/b/data.csv") == [data]
+        calls = session.clients.drive.fake_files.calls
+        assert [call['q'] for call in calls] == [
+            (
+                "((('top' in parents) and name='a' and mimeType='{folder}')"
+                " or ((name='b') and mimeType='{folder}')) and trashed=false"
+            ).format(folder=folder),
+            "('b' in parents) and trashed=false and name='data.csv'"
+        ]
+        assert calls[0]['fields'] == gdu.PATH_RESOLUTION_FIELDS
+
+    def test_path_from_the_root_is_resolved_without_looking_the_root_up(self):
+        a = {'id': "a", 'name': "a", 'mimeType': gdu.FOLDER, 'parents': ["real_root"]}
+        b = {'id': "b", 'name': "b", 'mimeType': gdu.FOLDER, 'parents': ["a"]}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["b"], 'modifiedTime': "2024-01-01T00:00:00.000Z"}
+        # The fake drive has no files.get, the real ID of the root is not needed
+        session = get_session({None: {'files': [a, b, data]}})
+        assert session.get_items_from_path("/a/b/data.csv") == [data]
+        assert len(session.clients.drive.fake_files.calls) == 2
+
+    def test_shared_leaf_name_is_only_searched_in_its_parents(self):
+        folder = "application/vnd.google-apps.folder"
+        items = [{'id': "data", 'name': "data", 'mimeType': folder, 'parents': ["top"]}]
+        for index in range(3000):
+            partition_id = "p{}".format(index)
+            items.append({'id': partition_id, 'name': partition_id, 'mimeType': folder, 'parents': ["data"]})
+            items.append({'id': "out_" + partition_id, 'name': "out-s0.csv.gz", 'mimeType': "application/gzip", 'parents': [partition_id]})
+        session = get_session()
+        session.clients = FakeClients(FakeDrive(None))
+        session.clients.drive.fake_files = FakeCorpusFiles(items)
+        session.path_cache.set(["top"], [{'id': "top", 'name': "top", 'mimeType': folder}])
+        files = session.get_items_from_path("/top/data/p1234/out-s0.csv.gz")
+        assert [file['id'] for file in files] == ["out_p1234"]
+        calls = session.clients.drive.fake_files.calls
+        assert len(calls) == 2
+        assert "out-s0.csv.gz" not in calls[0]['q']
+        assert calls[1]['q'].startswith("('p1234' in parents)")
+
+        # Below a cached prefix, the two remaining names are walked in two scoped calls
+        files = session.get_items_from_path("/top/data/p42/out-s0.csv.gz")
+        assert [file['id'] for file in files] == ["out_p42"]
+        assert len(calls) == 4
+        assert all("out-s0.csv.gz" not in call['q'] or "'p42' in parents" in call['q'] for call in calls[2:])
+
+    def test_path_resolution_stops_at_the_last_allowed_page(self):
+        pages = {}
+        for index in range(gdu.MAX_PATH_RESOLUTION_PAGES + 2):
+            pages[None if index == 0 else "page_{}".format(index)] = {'files': [], 'nextPageToken': "page_{}".format(index + 1)}
+        session = get_session(pages)
+        assert session.googledrive_list_candidates("name='a'") is None
+        assert len(session.clients.drive.fake_files.calls) == gdu.MAX_PATH_RESOLUTION_PAGES
+
+    def test_flat_sweep_falls_back_when_the_root_is_a_folder(self):
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["folder"]}
+        session = get_session({None: {'files': [data]}}, config={"googledrive_root_id": "folder", "shared_drive_flat_sweep": True})
+        folder = {'id': "folder", 'name': "folder", 'mimeType': "application/vnd.google-apps.folder"}
+        assert list(session.list_tree(folder)) == [("/data.csv", data)]
+        assert list(session.list_tree(folder)) == [("/data.csv", data)]
+        assert session.clients.drive.fake_drives.calls == ["folder"]
+        assert all('driveId' not in call for call in session.clients.drive.fake_files.calls)
+
+    def test_folder_is_listed_without_holding_the_index_lock(self):
+        session = get_session({})
+        listed = []
+
+        def googledrive_list(query, fields=None):
+            assert not session.folder_indexes_lock.locked()
+            listed.append(query)
+            if len(listed) == 2:
+                # Uploaded by another thread while the folder is listed
+                session.remember_file_in_folder("other.csv", "other", "folder")
+            return [{'id': "data", 'name': "data.csv"}]
+
+        session.googledrive_list = googledrive_list
+        assert session.find_file_in_folder("data.csv", "folder") == "data"
+        assert session.find_file_in_folder("data.csv", "folder") == "data"
+        assert session.find_file_in_folder("other.csv", "folder") == "other"
+        assert len(listed) == 2
+        assert session.folder_listings == {}
+
+    def test_folders_are_created_under_different_parents_in_parallel(self):
+        session = get_session({})
+        session.known_directories.set(["a"], ["a_id"])
+        session.known_directories.set(["b"], ["b_id"])
+        listing, release = threading.Event(), threading.Event()
+        created = []
+
+        def googledrive_list(query, fields=None):
+            if "'a_id' in parents" in query:
+                listing.set()
+                assert release.wait(5)
+            return []
+
+        def create_directory(name, parent_ids):
+            created.append(name)
+            return name + "_id"
+
+        session.googledrive_list = googledrive_list
+        session.create_directory = create_directory
+        thread = threading.Thread(target=session.create_directory_from_path, args=("/a/x",))
+        thread.start()
+        assert listing.wait(5)
+        assert session.create_directory_from_path("/b/y") == "y_id"
+        release.set()
+        thread.join()
+        assert created == ["y", "x"]
+        assert session.create_directory_from_path("/a/x") == "x_id"
+
+    def test_large_upload_is_streamed(self):
+        http = FakeUploadHttp()
+        session = get_session(http=http, config={"upload_chunk_size": 1, "multipart_upload_threshold": 1})
+        content = b"x" * (2 * gdu.MEGABYTE)
+        session.googledrive_upload("data.csv", BytesIO(content), parent_id="folder")
+        assert bytes(http.content) == content
+        assert http.content_ranges == [
+            "bytes 0-{}/*".format(gdu.MEGABYTE - 1),
+            "bytes {}-{}/{}".format(gdu.MEGABYTE, 2 * gdu.MEGABYTE - 1, 2 * gdu.MEGABYTE)
+        ]
+
+    def test_multipart_upload_is_retried_by_a_single_layer(self):
+        http = FakeUploadHttp(failures=2)
+        session = get_session(http=http)
+        session.googledrive_upload("data.csv", BytesIO(b"a,b\n1,2\n"), parent_id="folder")
+        assert len(http.uploads) == 3
+        assert all("uploadType=multipart" in uri for uri in http.uploads)
+
+        http = FakeUploadHttp(failures=100)
+        session = get_session(http=http)
+        with pytest.raises(GoogleDriveSessionError):
+            session.googledrive_upload("data.csv", BytesIO(b"a,b\n1,2\n"), parent_id="folder")
+        assert len(http.uploads) == session.max_attempts
+
+    def test_oauth_quota_is_shared_per_client(self, monkeypatch):
+        monkeypatch.setattr(dku_googledrive.session, "_oauth_client_ids", {})
+        http = FakeTokenInfoHttp({"token_1": "app_a", "token_2": "app_a", "token_3": "app_b"})
+        first_key = GoogleDriveSession.get_oauth_quota_key("token_1", http)
+        assert first_key == GoogleDriveSession.get_oauth_quota_key("token_2", http)
+        assert first_key != GoogleDriveSession.get_oauth_quota_key("token_3", http)
+        assert GoogleDriveSession.get_oauth_quota_key("token_1", http) == first_key
+        assert len(http.requests) == 3
+        unknown_key = GoogleDriveSession.get_oauth_quota_key("expired", http)
+        assert unknown_key not in (first_key, GoogleDriveSession.get_oauth_quota_key("expired_too", http))
+        # Failed lookups are not made again
+        assert GoogleDriveSession.get_oauth_quota_key("expired", http) == unknown_key
+        assert len(http.requests) == 5
+
+    def test_oauth_client_is_only_looked_up_for_a_node_wide_quota(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(dku_googledrive.session, "_oauth_client_ids", {})
+        monkeypatch.setenv("DIP_HOME", str(tmp_path))
+        http = FakeTokenInfoHttp({"token": "app"})
+        monkeypatch.setattr(dku_googledrive.session, "PooledHttp", lambda **kwargs: http)
+        config = {"auth_type": "oauth", "oauth_credentials": {"access_token": "token"}, "queries_per_100_seconds": 100}
+        session = GoogleDriveSession(dict(config, node_wide_quota=False), {})
+        session.close()
+        assert http.requests == []
+        session = GoogleDriveSession(config, {})
+        session.close()
+        assert len(http.requests) == (1 if SharedTokenBucket.is_supported() else 0)
+
+    def test_export_is_streamed(self):
+        content = b"a,b\n1,2\n3,4\n"
+        http = FakeExportHttp(content, failures=1)
+        session = get_session(http=http)
+        sheet = {'id': "sheet", 'name': "sheet", 'mimeType': gdu.SPREADSHEET}
+        stream = BytesIO()
+        session.googledrive_download(sheet, stream)
+        assert stream.getvalue() == content
+        assert len(http.requests) == 2
+        uri, headers = http.requests[-1]
+        assert "/files/sheet/export" in uri and "mimeType=text%2Fcsv" in uri
+        assert headers["authorization"] == "Bearer test"
+        assert session.metrics.get_summary()["bytes_downloaded"] == len(content)
+
+    def test_limited_download_asks_for_the_limit_only(self):
+        content = bytes(bytearray(index % 251 for index in range(5 * gdu.MEGABYTE)))
+        http = FakeMediaHttp(content)
+        session = get_session(http=http)
+        data = {'id': "data", 'name': "data.bin", 'mimeType': "application/octet-stream"}
+        stream = BytesIO()
+        session.googledrive_download(data, stream, limit=1000)
+        assert stream.getvalue() == content[:1000]
+        assert http.ranges == ["bytes=0-999"]
+
+    def test_limited_download_stops_once_the_limit_is_reached(self):
+        content = bytes(bytearray(index % 251 for index in range(5 * gdu.MEGABYTE)))
+        http = FakeMediaHttp(content)
+        session = get_session(http=http)
+        data = {'id': "data", 'name': "data.bin", 'mimeType': "application/octet-stream"}
+        stream = BytesIO()
+        limit = 3 * gdu.MEGABYTE // 2
+        session.googledrive_download(data, stream, limit=limit)
+        assert stream.getvalue() == content[:limit]
+        # Split in even chunks, the last one ending at the limit
+        assert http.ranges == ["bytes=0-{}".format(limit // 2 - 1), "bytes={}-{}".format(limit // 2, limit - 1)]
+
+    def test_limited_export_is_truncated(self):
+        content = b"a,b\n" * 100
+        http = FakeExportHttp(content, chunk_size=4)
+        session = get_session(http=http)
+        sheet = {'id': "sheet", 'name': "sheet", 'mimeType': gdu.SPREADSHEET}
+        stream = BytesIO()
+        session.googledrive_download(sheet, stream, limit=10)
+        assert stream.getvalue() == content[:10]
+        assert http.chunks_sent == 3
+
+    def test_trash_is_split_in_batches(self):
+        session = get_session({})
+        items = [{'id': "item_{}".format(index)} for index in range(2 * gdu.MAX_BATCH_SIZE + 50)]
+        assert session.googledrive_trash(items) == len(items)
+        batches = session.clients.drive.batches
+        assert [len(batch) for batch in batches] == [gdu.MAX_BATCH_SIZE, gdu.MAX_BATCH_SIZE, 50]
+        assert sum(batches, []) == [item['id'] for item in items]
+
+    def test_only_failed_sub_requests_are_retried(self):
+        session = get_session({})
+        session.clients.drive.statuses = {"b": [503], "c": [503, 503]}
+        assert session.googledrive_trash([{'id': "a"}, {'id': "b"}, {'id': "c"}]) == 3
+        assert session.clients.drive.batches == [["a", "b", "c"], ["b", "c"], ["c"]]
+
+    def test_missing_items_are_not_counted_as_trashed(self):
+        session = get_session({})
+        session.clients.drive.statuses = {"missing": [404]}
+        responses = session.googledrive_batch(
+            [session.drive.files().update(fileId=file_id) for file_id in ["a", "missing"]],
+            context="delete"
+        )
+        assert responses == [{'id': "a"}, None]
+        session.clients.drive.batches = []
+        session.clients.drive.statuses = {"missing": [404]}
+        assert session.googledrive_trash([{'id': "a"}, {'id': "missing"}]) == 1
+        assert session.clients.drive.batches == [["a", "missing"]]
+
+    def test_permission_error_is_not_retried(self):
+        session = get_session({})
+        session.clients.drive.statuses = {"b": [403], "c": [503]}
+        with pytest.raises(GoogleDriveSessionError, match="insufficientFilePermissions"):
+            session.googledrive_trash([{'id': "a"}, {'id': "b"}, {'id': "c"}])
+        assert len(session.clients.drive.batches) == 1
+
+    def test_listings_fan_out_and_keep_their_order(self):
+        session = get_session({}, config={"max_parallel_requests": 4})
+        folder_ids = ["folder_{}".format(index) for index in range(8)]
+        batches = session.split_level(folder_ids)
+        assert batches == [folder_ids[start:start + 2] for start in range(0, 8, 2)]
+
+        # Every listing waits for the others to start, then the last ones complete first
+        started = threading.Barrier(len(batches), timeout=5)
+        completed = []
+        completed_lock = threading.Lock()
+
+        def googledrive_list(query, fields=None):
+            started.wait()
+            parent_ids = re.findall(r"'(folder_\d)' in parents", query)
+            time.sleep(0.1 * (len(folder_ids) - int(parent_ids[0][-1])) / len(folder_ids))
+            with completed_lock:
+                completed.append(parent_ids[0])
+            return [{'id': "child_of_" + parent_id, 'name': "child", 'parents': [parent_id]} for parent_id in parent_ids]
+
+        session.googledrive_list = googledrive_list
+        pairs = list(session.googledrive_list_children_of(folder_ids))
+        assert completed != [batch[0] for batch in batches]
+        assert [parent_id for parent_id, child in pairs] == folder_ids
+        assert [child['id'] for parent_id, child in pairs] == ["child_of_" + folder_id for folder_id in folder_ids]
+        session.close()
+
+    def test_folders_on_the_path_are_listed_with_the_path_fields(self):
+        a = {'id': "a", 'name': "a", 'mimeType': gdu.FOLDER, 'parents': ["root"], 'modifiedTime': "2024-01-01T00:00:00.000Z", 'size': "0"}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["a"], 'modifiedTime': "2024-01-01T00:00:00.000Z", 'size': "8"}
+        session = get_session()
+        session.clients.drive.fake_files = FakeCorpusFiles([a, data])
+        assert session.get_items_from_path("/a/data.csv") == [data]
+        calls = session.clients.drive.fake_files.calls
+        assert [call['fields'] for call in calls] == [gdu.PATH_LIST_FIELDS, gdu.LIST_FIELDS]
+
+    def test_cached_folder_is_listed_again_with_all_fields_when_it_is_the_target(self):
+        a = {'id': "a", 'name': "a", 'mimeType': gdu.FOLDER, 'parents': ["root"], 'modifiedTime': "2024-01-01T00:00:00.000Z", 'size': "0"}
+        data = {'id': "data", 'name': "data.csv", 'mimeType': "text/csv", 'parents': ["a"], 'modifiedTime': "2024-01-01T00:00:00.000Z", 'size': "8"}
+        session = get_session()
+        session.clients.drive.fake_files = FakeCorpusFiles([a, data])
+        session.get_items_from_path("/a/data.csv")
+        assert gdu.MODIFIED_TIME not in session.path_cache.get(["a"])[0]
+        assert session.get_items_from_path("/a") == [a]
+        calls = session.clients.drive.fake_files.calls
+        assert len(calls) == 3
+        assert calls[2]['fields'] == gdu.LIST_FIELDS
+        assert calls[2]['q'].startswith("('root' in parents)")
+        # Cached with all its fields from then on
+        assert session.get_items_from_path("/a") == [a]
+        assert len(calls) == 3
+
+    def test_retries_stop_at_the_attempts_of_the_retry_policy(self):
+        session = get_session({None: get_http_error(503, "backendError")})
+        session.retry_policy = RetryPolicy(max_attempts=2, base_delay=0)
+        with pytest.raises(GoogleDriveSessionError):
+            session.googledrive_list("name='a'")
+        assert len(session.clients.drive.fake_files.calls) == 2
@@ -0,0 +1,72 @@
+import re
+from io import BytesIO
+
+import httplib2
+import pytest
+from googleapiclient.http import HttpRequest
+
+from dku_googledrive.streaming_upload import StreamingMediaUpload, StreamingMediaUploadError, read_prefix
+
+CHUNK_SIZE = 512 * 1024
+
+
+class FakeResumableHttp():
+    """
+    Accepts a resumable upload like Google Drive does, checking the Content-Range of each chunk
+    """
+    def __init__(self):
+        self.content = bytearray()
+        self.content_ranges = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if uri != "https://upload.example/session":
+            return httplib2.Response({"status": 200, "location": "https://upload.example/session"}), b""
+        content_range = headers.get("Content-Range")
+        self.content_ranges.append(content_range)
+        match = re.match(r"^bytes (\d+)-(\d+)/(\d+|\*)$", content_range)
+        assert match, "Invalid Content-Range {}".format(content_range)
+        start, end = int(match.group(1)), int(match.group(2))
+        assert start == len(self.content) and end >= start and end - start + 1 == len(body)
+        self.content.extend(body)
+        if match.group(3) == "*":
+            return httplib2.Response({"status": 308, "range": "bytes=0-{}".format(end)}), b""
+        assert int(match.group(3)) == len(self.content)
+        return httplib2.Response({"status": 200}), b'{"id": "file_id"}'
+
+
+def upload(content, prefix_size=0):
+    stream = BytesIO(content)
+    prefix = read_prefix(stream, prefix_size)
+    media = StreamingMediaUpload(stream, mimetype="text/csv", chunksize=CHUNK_SIZE, prefix=prefix)
+    http = FakeResumableHttp()
+    request = HttpRequest(
+        http, lambda response, body: body, "https://upload.example/files?uploadType=resumable",
+        method="POST", body="{}", headers={"content-type": "application/json"}, methodId="drive.files.create", resumable=media
+    )
+    response = None
+    while response is None:
+        status, response = request.next_chunk()
+    assert bytes(http.content) == content
+    assert media.bytes_read == len(content)
+    return http
+
+
+class TestStreamingMediaUpload:
+
+    def test_read_prefix(self):
+        stream = BytesIO(b"0123456789")
+        assert read_prefix(stream, 4) == b"0123"
+        assert read_prefix(stream, 100) == b"456789"
+        assert read_prefix(stream, 1) == b""
+
+    def test_upload_of_an_exact_multiple_of_the_chunk_size(self):
+        http = upload(b"x" * (2 * CHUNK_SIZE))
+        assert http.content_ranges == ["bytes 0-{}/*".format(CHUNK_SIZE - 1), "bytes {}-{}/{}".format(CHUNK_SIZE, 2 * CHUNK_SIZE - 1, 2 * CHUNK_SIZE)]
+
+    def test_upload_of_a_partial_last_chunk(self):
+        http = upload(b"x" * (CHUNK_SIZE + 10), prefix_size=1000)
+        assert http.content_ranges == ["bytes 0-{}/*".format(CHUNK_SIZE - 1), "bytes {}-{}/{}".format(CHUNK_SIZE, CHUNK_SIZE + 9, CHUNK_SIZE + 10)]
+
+    def test_upload_cannot_be_serialized(self):
+        with pytest.raises(StreamingMediaUploadError):
+            StreamingMediaUpload(BytesIO(b"data"), mimetype="text/csv", chunksize=CHUNK_SIZE).to_json()
@@ -0,0 +1,121 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from dku_googledrive.transport import PooledHttp, TimeoutHttp
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LargeBodyHandler(KeepAliveHandler):
+    body = b"x" * (3 * 1024 * 1024)
+
+    def do_GET(self):
+        if self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "9")
+            self.end_headers()
+            self.wfile.write(b"not found")
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        try:
+            self.wfile.write(self.body)
+        except (IOError, OSError):
+            pass
+
+
+def start_server(handler):
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    return server, thread, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def stop_server(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+class TestPooledHttp:
+
+    def test_gzip_headers(self):
+        headers = PooledHttp.get_headers({"User-Agent": "client/1.0", "accept": "application/json"})
+        assert headers["user-agent"] == "client/1.0 (gzip)"
+        assert headers["accept-encoding"] == "gzip, deflate"
+        assert "User-Agent" not in headers
+        assert PooledHttp.get_headers({"user-agent": "client/1.0 (gzip)"})["user-agent"] == "client/1.0 (gzip)"
+        assert "accept-encoding" not in PooledHttp.get_headers({"range": "bytes=0-1023"})
+
+    def test_idle_clients_are_reused(self):
+        transport = PooledHttp(connect_timeout=1, read_timeout=2, max_idle=1)
+        first = transport.acquire()
+        second = transport.acquire()
+        assert first is not second
+        assert first.timeout == 1 and first.read_timeout == 2
+        assert 308 not in first.redirect_codes
+        transport.release(first)
+        transport.release(second)
+        assert transport.acquire() is first
+        transport.close()
+
+
+class TestTimeoutHttp:
+
+    def test_read_timeout_is_set_on_every_connection(self):
+        server = HTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            http = TimeoutHttp(connect_timeout=1, read_timeout=7)
+            uri = "http://127.0.0.1:{}/".format(server.server_address[1])
+            response, content = http.request(uri)
+            assert content == b"ok"
+            connection = list(http.connections.values())[0]
+            assert connection.timeout == 1
+            assert connection.sock.gettimeout() == 7
+            # Reconnected by httplib2 itself
+            connection.close()
+            response, content = http.request(uri)
+            assert content == b"ok"
+            assert connection.sock.gettimeout() == 7
+            http.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_body_is_streamed_in_chunks(self):
+        server, thread, uri = start_server(LargeBodyHandler)
+        try:
+            http = TimeoutHttp(connect_timeout=1, read_timeout=7)
+            chunks = []
+            response, content = http.stream(uri + "/export", chunks.append, chunk_size=1024 * 1024)
+            assert response.status == 200 and content is None
+            assert [len(chunk) for chunk in chunks] == [1024 * 1024] * 3
+            assert b"".join(chunks) == LargeBodyHandler.body
+            # Fully read, the connection is kept for the next requests
+            connection = list(http.connections.values())[0]
+            response, content = http.stream(uri + "/missing", chunks.append)
+            assert response.status == 404 and content == b"not found"
+            assert list(http.connections.values())[0] is connection
+
+            chunks = []
+            response, content = http.stream(uri + "/export", chunks.append, is_done=lambda: len(chunks) > 0, chunk_size=1024)
+            assert len(chunks) == 1
+            assert http.connections == {}
+            http.close()
+        finally:
+            stop_server(server, thread)
@@ -0,0 +1,96 @@
+import io
+import threading
+
+import pytest
+
+from dku_googledrive.metrics import SessionMetrics
+from dku_googledrive.write_behind import WriteBehind, WriteBehindError, paths_overlap
+
+
+class FakeSession():
+    def __init__(self, release=None, failing_paths=()):
+        self.metrics = SessionMetrics()
+        self.uploaded = []
+        self.lock = threading.Lock()
+        self.release = release
+        self.failing_paths = failing_paths
+
+    def upload_to_path(self, full_path, stream):
+        if self.release is not None:
+            self.release.wait()
+        if full_path in self.failing_paths:
+            raise ValueError("upload failed")
+        with self.lock:
+            self.uploaded.append((full_path, stream.read()))
+
+
+class TestWriteBehind:
+
+    def test_uploads_in_background(self):
+        release = threading.Event()
+        session = FakeSession(release=release)
+        write_behind = WriteBehind(session, max_uploads=2, max_spooled_bytes=1000)
+        write_behind.write("/out/a.csv", io.BytesIO(b"a"))
+        write_behind.write("/out/b.csv", io.BytesIO(b"b"))
+        assert session.uploaded == []
+        assert write_behind.spooled_bytes == 2
+        release.set()
+        write_behind.flush("/out")
+        assert sorted(session.uploaded) == [("/out/a.csv", b"a"), ("/out/b.csv", b"b")]
+        write_behind.close()
+        assert write_behind.spooled_bytes == 0
+
+    def test_same_path_keeps_order(self):
+        session = FakeSession()
+        write_behind = WriteBehind(session, max_uploads=4, max_spooled_bytes=1000)
+        for version in range(5):
+            write_behind.write("/out/a.csv", io.BytesIO(str(version).encode("utf-8")))
+        write_behind.close()
+        assert session.uploaded == [("/out/a.csv", str(version).encode("utf-8")) for version in range(5)]
+
+    def test_failures_are_raised(self):
+        session = FakeSession(failing_paths=["/out/a.csv"])
+        write_behind = WriteBehind(session, max_uploads=1, max_spooled_bytes=1000)
+        write_behind.write("/out/a.csv", io.BytesIO(b"a"))
+        write_behind.flush()
+        with pytest.raises(WriteBehindError):
+            write_behind.write("/out/b.csv", io.BytesIO(b"b"))
+        with pytest.raises(WriteBehindError):
+            write_behind.close()
+
+    def test_spooled_file_counts_towards_the_buffer(self):
+        release = threading.Event()
+        session = FakeSession(release=release)
+        write_behind = WriteBehind(session, max_uploads=2, max_spooled_bytes=10)
+        write_behind.COPY_CHUNK_SIZE = 4
+        write_behind.write("/out/a.csv", io.BytesIO(b"aaaaaa"))
+        writer = threading.Thread(target=write_behind.write, args=("/out/b.csv", io.BytesIO(b"bbbbbb")))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        assert write_behind.spooled_bytes == 10
+        release.set()
+        writer.join()
+        write_behind.close()
+        assert sorted(session.uploaded) == [("/out/a.csv", b"aaaaaa"), ("/out/b.csv", b"bbbbbb")]
+        assert write_behind.spooled_bytes == 0
+
+    def test_file_bigger_than_the_buffer_is_uploaded_before_returning(self):
+        session = FakeSession()
+        write_behind = WriteBehind(session, max_uploads=2, max_spooled_bytes=10)
+        write_behind.COPY_CHUNK_SIZE = 4
+        content = b"0123456789" * 3
+        write_behind.write("/out/a.csv", io.BytesIO(content))
+        assert session.uploaded == [("/out/a.csv", content)]
+        assert write_behind.spooled_bytes == 0
+        session.failing_paths = ["/out/b.csv"]
+        with pytest.raises(ValueError):
+            write_behind.write("/out/b.csv", io.BytesIO(content))
+        assert write_behind.spooled_bytes == 0
+        write_behind.close()
+
+    def test_paths_overlap(self):
+        assert paths_overlap("/", "/out/a.csv")
+        assert paths_overlap("/out", "/out/a.csv")
+        assert paths_overlap("/out/a.csv/x", "/out/a.csv")
+        assert not paths_overlap("/out/a", "/out/a.csv")